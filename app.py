@@ -8,12 +8,8 @@ from routes.work_optimize2 import work_optimize2_bp
 from routes.rocket import rocket_bp
 from routes.misc import misc_bp
 from routes.ut_eitan_quiz import ut_eitan_quiz_bp
-from routes.ut_eitan_quiz_1 import ut_eitan_quiz_bp_1
-from routes.ut_eitan_quiz_2 import ut_eitan_quiz_bp_2
-from routes.ut_eitan_quiz_3 import ut_eitan_quiz_bp_3
-from routes.ut_eitan_quiz_4 import ut_eitan_quiz_bp_4
-from routes.ut_eitan_quiz_5 import ut_eitan_quiz_bp_5
-from routes.ut_eitan_quiz_6 import ut_eitan_quiz_bp_6
+from routes.quiz_corpus import load_artifact
+from routes.batch_convert import batch_convert_command
 
 # .env読み込み
 load_dotenv()
@@ -39,13 +35,15 @@ app.register_blueprint(work_optimize2_bp, url_prefix="/opt2")
 app.register_blueprint(rocket_bp)
 app.register_blueprint(misc_bp)
 
+# 東大英単クイズ（全問題セットを1つのBlueprintで提供）
 app.register_blueprint(ut_eitan_quiz_bp)
-app.register_blueprint(ut_eitan_quiz_bp_1)
-app.register_blueprint(ut_eitan_quiz_bp_2)
-app.register_blueprint(ut_eitan_quiz_bp_3)
-app.register_blueprint(ut_eitan_quiz_bp_4)
-app.register_blueprint(ut_eitan_quiz_bp_5)
-app.register_blueprint(ut_eitan_quiz_bp_6)
+
+# コマンドラインからの一括変換（flask --app app batch-convert INPUT_DIR OUTPUT_DIR）
+app.cli.add_command(batch_convert_command)
+
+# 事前コンパイル済みの問題データ（flask --app app ut_eitan_quiz build-corpus で作成）があれば読み込む。
+# gunicorn --preload では fork 前に読み込まれ、各ワーカーがメモリを共有する
+load_artifact()
 if __name__ == '__main__':
     # 開発環境ではdebug=True
     app.run(debug=True)
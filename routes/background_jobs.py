@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================
+# 時間のかかる変換処理をバックグラウンドで実行するジョブ管理
+#
+# ジョブの状態は <spool_dir>/<job_id>.json、結果は <spool_dir>/<job_id>.csv に保存する。
+# 状態をファイルに置くため、同じマシン上の別ワーカーに問い合わせが来ても参照できる。
+# =========================
+
+
+class JobManager:
+    def __init__(self, name, run, spool_dir=None, max_workers=2, ttl=24 * 60 * 60):
+        """run(params, job) は結果のバイト列のイテラブルを返すか、{"error": ...} を返す関数"""
+        self.name = name
+        self.run = run
+        self.spool_dir = spool_dir or os.path.join(tempfile.gettempdir(), f"legendary-pancake-{name}")
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    # ---------- ファイル配置 ----------
+
+    def _status_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def result_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.csv")
+
+    def _write_status(self, status):
+        # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+        path = self._status_path(status["id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id):
+        """ジョブの状態を返す（存在しなければ None）"""
+        # ジョブIDはファイル名に使うため、uuid の16進表記以外は受け付けない
+        if not job_id or len(job_id) != 32 or any(c not in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._status_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ---------- 実行 ----------
+
+    def _get_executor(self):
+        # gunicorn の fork 後に親プロセスのスレッドプールを使わないよう、プロセスごとに作る
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f"{self.name}-job")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, params):
+        """ジョブを登録してすぐに job_id を返す"""
+        self.prune()
+        job_id = uuid.uuid4().hex
+        status = {
+            "id": job_id,
+            "state": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "progress": {},
+            "errors": [],
+        }
+        self._write_status(status)
+        self._get_executor().submit(self._run_job, JobHandle(self, status), params)
+        return job_id
+
+    def _run_job(self, job, params):
+        job.update(state="running")
+        try:
+            result = self.run(params, job)
+            if isinstance(result, dict) and "error" in result:
+                job.update(state="failed", errors=result["error"].splitlines(), finished_at=time.time())
+                return
+
+            tmp_path = self.result_path(job.id) + ".part"
+            with open(tmp_path, "wb") as f:
+                for chunk in result:
+                    f.write(chunk)
+            os.replace(tmp_path, self.result_path(job.id))
+            job.update(state="done", finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            job.update(state="failed", errors=job.status["errors"] + [f"内部エラー: {e}"],
+                       finished_at=time.time())
+
+    def prune(self):
+        """期限切れのジョブ（状態ファイル・結果ファイル）を削除する"""
+        limit = time.time() - self.ttl
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class JobHandle:
+    """実行中のジョブから進捗を書き込むためのオブジェクト"""
+
+    def __init__(self, manager, status):
+        self.manager = manager
+        self.status = status
+        self.id = status["id"]
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            self.status.update(fields)
+            self.manager._write_status(self.status)
+
+    def set_progress(self, **progress):
+        with self._lock:
+            self.status["progress"].update(progress)
+            self.manager._write_status(self.status)
+
+    def add_error(self, message):
+        with self._lock:
+            self.status["errors"].append(message)
+            self.manager._write_status(self.status)
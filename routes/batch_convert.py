@@ -0,0 +1,171 @@
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import click
+from routes.csv_export import iter_csv_bytes
+from routes import work_optimize1 as opt1
+from routes import work_optimize2 as opt2
+
+# =========================
+# opt1 / opt2 の変換をコマンドラインからまとめて実行する
+#
+#   flask --app app batch-convert INPUT_DIR OUTPUT_DIR [--jobs N]
+#
+#   INPUT_DIR/opt1/*.json          … opt1 の入力（キーは入力フォームの name と同じ: departure_rate,
+#                                    facility, sale_from, sale_to, airport, participants）
+#   INPUT_DIR/opt2/*.csv, *.json   … opt2 の路線仕様ファイル（一括変換と同じ形式）
+#
+# 出力は OUTPUT_DIR/opt1/<名前>.csv, OUTPUT_DIR/opt2/<名前>.csv（Shift-JIS）。
+# エラーがあった場合は <名前>.errors.csv も書き出す。
+# opt1 のホテル情報は最初に全ファイル分をまとめて取得し、各プロセスへ渡す（同じ施設は1回だけ問い合わせる）。
+# =========================
+OPT1_SPEC_FIELDS = ["departure_rate", "facility", "sale_from", "sale_to", "airport", "participants"]
+
+
+def _write_chunks(path, chunks):
+    # 書きかけのファイルが残らないよう、一時ファイルに書いてから置き換える
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+def _list_files(directory, extensions):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(extensions)
+    )
+
+
+def _output_paths(output_dir, spec_path):
+    stem = os.path.splitext(os.path.basename(spec_path))[0]
+    return os.path.join(output_dir, f"{stem}.csv"), os.path.join(output_dir, f"{stem}.errors.csv")
+
+
+def load_opt1_spec(path):
+    """opt1 の入力ファイルを transform_data_for_csv に渡せる形にする"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        record = json.load(f)
+    if not isinstance(record, dict):
+        raise ValueError("JSONのオブジェクト（{...}）で指定してください")
+    return opt1.form_to_data_dict({name: str(record.get(name, "") or "") for name in OPT1_SPEC_FIELDS})
+
+
+def convert_opt1_file(spec_path, output_dir, known_hotels):
+    """opt1 の1ファイル分を変換して書き出す（プロセスプールの中で実行される）"""
+    csv_path, errors_path = _output_paths(output_dir, spec_path)
+    result = opt1.transform_data_for_csv(load_opt1_spec(spec_path), partial=True, known_hotels=known_hotels)
+    if "error" in result:
+        return {"file": spec_path, "error": result["error"]}
+
+    rows = 0
+
+    def counted(row_iter):
+        nonlocal rows
+        for row in row_iter:
+            rows += 1
+            yield row
+
+    _write_chunks(csv_path, iter_csv_bytes(counted(result["rows"])))
+    if result["failed"]:
+        _write_chunks(errors_path, opt1.iter_error_sheet_bytes(result["failed"]))
+    return {"file": spec_path, "rows": rows, "errors": len(result["failed"])}
+
+
+def convert_opt2_file(spec_path, output_dir):
+    """opt2 の1ファイル分を変換して書き出す（プロセスプールの中で実行される）"""
+    csv_path, errors_path = _output_paths(output_dir, spec_path)
+    with open(spec_path, "rb") as f:
+        records = opt2.parse_spec_records(f.read(), spec_path)
+    specs, errors = opt2.compile_bulk_specs(records)
+
+    now_str = datetime.now(opt2.JST).strftime("%Y/%m/%d %H:%M:%S")
+    _write_chunks(csv_path, opt2.iter_bulk_csv_bytes(specs, now_str))
+    if errors:
+        _write_chunks(errors_path, opt2.iter_spec_error_bytes(errors))
+    return {
+        "file": spec_path,
+        "rows": sum(len(spec["flight_numbers"]) for spec in specs) * len(opt2.youbi_list),
+        "errors": len(errors),
+    }
+
+
+def resolve_hotels(opt1_specs):
+    """全ファイルの施設番号をまとめて問い合わせ、{施設番号: ホテル情報（またはエラー）} を返す"""
+    nums = []
+    for data_dict in opt1_specs.values():
+        nums.extend(opt1.compile_conversion(data_dict).hotel_nums)
+    return opt1.fetch_hotel_infos(nums)
+
+
+def run_batch(input_dir, output_dir, jobs=None, echo=print):
+    """INPUT_DIR 配下の仕様ファイルをすべて変換する。失敗したファイル数を返す"""
+    opt1_files = _list_files(os.path.join(input_dir, "opt1"), (".json",))
+    opt2_files = _list_files(os.path.join(input_dir, "opt2"), (".csv", ".json"))
+    opt1_out = os.path.join(output_dir, "opt1")
+    opt2_out = os.path.join(output_dir, "opt2")
+    if opt1_files:
+        os.makedirs(opt1_out, exist_ok=True)
+    if opt2_files:
+        os.makedirs(opt2_out, exist_ok=True)
+
+    failures = 0
+
+    # 1. opt1 の入力を読み込んで検証し、正しいファイルの施設だけまとめて問い合わせる
+    opt1_specs = {}
+    for path in opt1_files:
+        try:
+            data_dict = load_opt1_spec(path)
+        except (OSError, ValueError) as e:
+            echo(f"失敗: {path}: {e}")
+            failures += 1
+            continue
+        errors = opt1.validation_errors(opt1.compile_conversion(data_dict), partial=True)
+        if errors:
+            echo(f"失敗: {path}: " + " / ".join(errors))
+            failures += 1
+            continue
+        opt1_specs[path] = data_dict
+    known_hotels = resolve_hotels(opt1_specs) if opt1_specs else {}
+
+    # 2. ファイルごとの変換をプロセスに振り分ける
+    # 親プロセスは問い合わせでスレッドを使っているため、fork ではなく spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        futures = []
+        for path, data_dict in opt1_specs.items():
+            nums = opt1.compile_conversion(data_dict).hotel_nums
+            subset = {num: known_hotels[num] for num in nums if num in known_hotels}
+            futures.append(executor.submit(convert_opt1_file, path, opt1_out, subset))
+        for path in opt2_files:
+            futures.append(executor.submit(convert_opt2_file, path, opt2_out))
+
+        for future in futures:
+            try:
+                summary = future.result()
+            except Exception as e:
+                echo(f"失敗: {e}")
+                failures += 1
+                continue
+            if "error" in summary:
+                echo(f"失敗: {summary['file']}: {summary['error']}")
+                failures += 1
+            else:
+                echo(f"{summary['file']}: {summary['rows']} 行（エラー {summary['errors']} 件）")
+    return failures
+
+
+@click.command("batch-convert")
+@click.argument("input_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.option("--jobs", type=int, default=None, help="同時に実行するプロセス数（既定はCPU数）")
+def batch_convert_command(input_dir, output_dir, jobs):
+    """INPUT_DIR/opt1, INPUT_DIR/opt2 の仕様ファイルをまとめて変換し OUTPUT_DIR に書き出す"""
+    failures = run_batch(input_dir, output_dir, jobs, echo=click.echo)
+    if failures:
+        raise click.exceptions.Exit(1)
@@ -0,0 +1,46 @@
+import io
+import csv
+import zipfile
+import tempfile
+import itertools
+
+# =========================
+# 変換結果のダウンロード用の共通処理（opt1 / opt2 / batch-convert）
+#
+# CSV は Shift-JIS・全列を "" で囲む形式。行を少しずつバイト列にして返すため、
+# 出力サイズによらずメモリ使用量は一定。
+# =========================
+
+
+def iter_csv_bytes(rows, chunk_rows=500):
+    """行のイテラブルを Shift-JIS のCSVバイト列に少しずつ変換して返す"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= chunk_rows:
+            yield buffer.getvalue().encode("shift_jis", errors="replace")
+            buffer.seek(0)
+            buffer.truncate(0)
+            count = 0
+    if count:
+        yield buffer.getvalue().encode("shift_jis", errors="replace")
+
+
+def iter_error_csv_bytes(columns, rows):
+    """エラー一覧（errors.csv）を見出し行 columns から始まるCSVバイト列で返す"""
+    return iter_csv_bytes(itertools.chain([columns], rows))
+
+
+def build_zip(members):
+    """(ファイル名, バイト列のイテラブル) の組をまとめたzipを作り、先頭から読める状態で返す"""
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    with zipfile.ZipFile(spool, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in members:
+            with zf.open(name, "w") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+    spool.seek(0)
+    return spool
@@ -0,0 +1,104 @@
+import os
+import time
+from routes.local_db import ThreadLocalSqlite, lazy_singleton
+
+# =========================
+# 楽天 SimpleHotelSearch の結果（施設名・地区コード）のキャッシュ
+# SQLiteファイルに保存するため、gunicorn の複数ワーカーで共有される
+# =========================
+HOTEL_CACHE_PATH = os.getenv(
+    "HOTEL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hotel_cache.sqlite3")
+)
+# 有効期限（秒）。0 以下でキャッシュを無効にする
+HOTEL_CACHE_TTL = int(os.getenv("HOTEL_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# 保存件数の上限（超えたら最終参照が古いものから削除）
+HOTEL_CACHE_MAX = int(os.getenv("HOTEL_CACHE_MAX", "50000"))
+
+
+class HotelCache:
+    def __init__(self, path=HOTEL_CACHE_PATH, ttl=HOTEL_CACHE_TTL, max_entries=HOTEL_CACHE_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = ThreadLocalSqlite(path, timeout=10)
+        self._puts = 0
+        if self.enabled:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS hotel_cache ("
+                    " hotel_no TEXT PRIMARY KEY,"
+                    " hotel_name TEXT NOT NULL,"
+                    " middle_class_code TEXT NOT NULL,"
+                    " small_class_code TEXT NOT NULL,"
+                    " fetched_at REAL NOT NULL,"
+                    " last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS hotel_cache_lru ON hotel_cache (last_access)")
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, hotel_no):
+        """キャッシュ済みのホテル情報を返す（期限切れ・未登録は None）"""
+        return self.get_many([hotel_no]).get(str(hotel_no))
+
+    def get_many(self, hotel_nos):
+        """キャッシュ済みのホテル情報を {施設番号: 情報} で返す（期限切れ・未登録は含めない）
+
+        1回の SELECT でまとめて読み、最終参照の更新も1回の executemany で行う。
+        """
+        if not self.enabled:
+            return {}
+        hotel_nos = list(dict.fromkeys(str(num) for num in hotel_nos))
+        now = time.time()
+        found = {}
+        with self._db.connect() as conn:
+            # SQLite の変数の数の上限を超えないよう分けて問い合わせる
+            for i in range(0, len(hotel_nos), 500):
+                chunk = hotel_nos[i:i + 500]
+                rows = conn.execute(
+                    "SELECT hotel_no, hotel_name, middle_class_code, small_class_code"
+                    f" FROM hotel_cache WHERE hotel_no IN ({','.join('?' * len(chunk))}) AND fetched_at >= ?",
+                    (*chunk, now - self.ttl)
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = {
+                        "hotelName": row[1],
+                        "middleClassCode": row[2],
+                        "smallClassCode": row[3],
+                    }
+            if found:
+                conn.executemany(
+                    "UPDATE hotel_cache SET last_access = ? WHERE hotel_no = ?",
+                    [(now, num) for num in found]
+                )
+        return found
+
+    def put(self, hotel_no, info):
+        """APIから取得したホテル情報を保存する"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO hotel_cache"
+                " (hotel_no, hotel_name, middle_class_code, small_class_code, fetched_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (str(hotel_no), info["hotelName"], info["middleClassCode"], info["smallClassCode"], now, now)
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """件数上限を超えた分を最終参照の古い順に削除する"""
+        conn.execute(
+            "DELETE FROM hotel_cache WHERE hotel_no IN ("
+            " SELECT hotel_no FROM hotel_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+get_hotel_cache = lazy_singleton(HotelCache)
@@ -0,0 +1,245 @@
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# =========================
+# 外部API（GAS・楽天など）への共通HTTPクライアント
+#
+# 接続先（upstream）ごとに以下を持つ:
+#   - keep-alive の接続プール（ホストごと。プロセスごとに作り直す）
+#   - 接続・読み込みのタイムアウト
+#   - ジッター付きの待ち時間での再試行
+#   - サーキットブレーカー（連続で失敗したら一定時間は問い合わせずに失敗させる）
+#   - 件数・レイテンシの集計（/metrics で確認できる。値はプロセスごと）
+# =========================
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+# 連続失敗何回でブレーカーを開くか、開いてから何秒後に試しに1件通すか
+HTTP_BREAKER_THRESHOLD = int(os.getenv("HTTP_BREAKER_THRESHOLD", "5"))
+HTTP_BREAKER_RESET = float(os.getenv("HTTP_BREAKER_RESET", "30"))
+
+# レイテンシの集計区間（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 再試行の対象にするステータスコード
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """ブレーカーが開いているため問い合わせなかった"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """問い合わせてよければ True（半開状態では1件だけ通す）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_sec": round(time.monotonic() - self.opened_at, 1) if self.state != self.CLOSED else None,
+            }
+
+
+class HttpClient:
+    def __init__(self, name, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff=0.5, pool_maxsize=10,
+                 breaker_threshold=HTTP_BREAKER_THRESHOLD, breaker_reset=HTTP_BREAKER_RESET,
+                 throttle=None, headers=None):
+        """throttle: 各試行の前に呼ぶ関数（流量制限の待ちなど）"""
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_maxsize = pool_maxsize
+        self.throttle = throttle
+        self.headers = headers or {}
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "retries": 0, "short_circuited": 0}
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0.0
+
+    def _get_session(self):
+        # gunicorn の fork 後に親プロセスの接続を使わないよう、プロセスごとに作る
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _observe(self, elapsed):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and elapsed > LATENCY_BUCKETS[i]:
+            i += 1
+        with self._lock:
+            self._latency_counts[i] += 1
+            self._latency_sum += elapsed
+
+    def request(self, method, url, retry=None, **kwargs):
+        """requests.request と同じ引数で呼ぶ。retry を省略すると GET のみ再試行する
+
+        POST は送信済みかもしれない失敗では再試行しない（接続できなかった場合のみ再試行）。
+        """
+        if retry is None:
+            retry = method.upper() == "GET"
+        kwargs.setdefault("timeout", self.timeout)
+        session = self._get_session()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpenError(f"{self.name} への接続を一時停止しています（連続して失敗したため）")
+            if self.throttle is not None:
+                try:
+                    self.throttle()
+                except Exception:
+                    # 半開状態の試行枠を開けたままにしない（開けたままだと以後すべて遮断される）
+                    self.breaker.record_failure()
+                    raise
+
+            self._count("requests")
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._observe(time.monotonic() - started)
+                self._count("errors")
+                self.breaker.record_failure()
+                can_retry = retry or isinstance(e, requests.ConnectTimeout)
+                if not can_retry or attempt >= self.retries:
+                    raise
+            except Exception:
+                # 送れない引数（json= に変換できない値など）による例外でも試行枠を開放する
+                self._observe(time.monotonic() - started)
+                self._count("errors")
+                self.breaker.record_failure()
+                raise
+            else:
+                self._observe(time.monotonic() - started)
+                if response.status_code < 500:
+                    # 4xx は相手が応答できているのでブレーカーの失敗には数えない
+                    self.breaker.record_success()
+                else:
+                    self._count("errors")
+                    self.breaker.record_failure()
+                if not (retry and response.status_code in RETRY_STATUS and attempt < self.retries):
+                    return response
+                response.close()
+
+            attempt += 1
+            self._count("retries")
+            time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            counts = list(self._latency_counts)
+            latency_sum = self._latency_sum
+            session = self._session if self._session_pid == os.getpid() else None
+
+        # ホストごとの接続プール: 新規接続数と、そのうち使い回されたリクエスト数
+        pools = {}
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                        "connections_opened": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "reused": max(0, pool.num_requests - pool.num_connections),
+                    }
+
+        # 各区間は「その秒数以下」の累積件数
+        buckets = {}
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("inf",), counts):
+            total += count
+            buckets[f"le_{bound}"] = total
+        return {
+            **stats,
+            "breaker": self.breaker.snapshot(),
+            "latency": {"count": total, "sum_sec": round(latency_sum, 3), "buckets": buckets},
+            "pools": pools,
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def register_upstream(name, **options):
+    """接続先ごとのクライアントを返す（同じ名前は同じクライアントを共有する）"""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = HttpClient(name, **options)
+            _clients[name] = client
+        return client
+
+
+def http_metrics():
+    return {name: client.metrics() for name, client in sorted(_clients.items())}
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import threading
+
+# =========================
+# ローカルのSQLiteファイルとプロセス内の共有オブジェクトの共通部品
+#
+# 出題状態・ホテル情報のキャッシュ・学習の進捗・送信待ちキューで使う。
+# =========================
+
+
+class ThreadLocalSqlite:
+    """スレッドごと（gunicorn の fork 後はプロセスごとにも）に sqlite3 の接続を持つ"""
+
+    def __init__(self, path, timeout=10, synchronous=None):
+        """synchronous: PRAGMA synchronous に設定する値（None なら既定のまま）"""
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self._local = threading.local()
+
+    def connect(self):
+        # sqlite3 の接続はスレッド間で共有できないためスレッドごとに持つ
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            if self.synchronous is not None:
+                conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def lazy_singleton(factory):
+    """初回の呼び出しで factory() を1回だけ実行し、以降は同じものを返す関数を作る"""
+    instance = None
+    lock = threading.Lock()
+
+    def get():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    instance = factory()
+        return instance
+
+    return get
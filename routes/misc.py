@@ -1,25 +1,66 @@
-from flask import Blueprint, request, render_template
-import requests
+import os
+import sqlite3
+from flask import Blueprint, request, render_template, jsonify
+from routes.http_client import register_upstream, http_metrics
+from routes.single_flight import single_flight_metrics
+from routes.local_db import lazy_singleton
+from routes.write_behind import WriteBehindQueue, post_each
 
 misc_bp = Blueprint('misc', __name__)
 
+gas_client = register_upstream('gas')
+
+TXTSTORE_GAS_URL = "https://script.google.com/macros/s/AKfycbwms2TFCe_m-uHQsaJUZ3SQbWKddtFm413BSNblBAKwxP2faJkz47DAYx2Vwb2zXL2p/exec"
+# 送信待ちのテキストを保存するSQLiteファイル
+TXTSTORE_SPOOL_PATH = os.getenv(
+    "TXTSTORE_SPOOL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "txtstore_spool.sqlite3")
+)
+
+
+def post_text(payload):
+    res = gas_client.post(TXTSTORE_GAS_URL, data={"text": payload["text"]})
+    res.raise_for_status()
+
+
+def post_texts(payloads):
+    """送信待ちのテキストを古い順にGASへ送る（GASは1件ずつ受け付けるため順番に送る）"""
+    return post_each(payloads, post_text)
+
+
+_txtstore_queue = lazy_singleton(lambda: WriteBehindQueue("txtstore", TXTSTORE_SPOOL_PATH, post_texts))
+
+
+def get_txtstore_queue():
+    queue = _txtstore_queue()
+    # 前回の起動時に送り残したテキストがあれば送信を再開する
+    queue.ensure_started()
+    return queue
+
 @misc_bp.route("/txtstore")
 def txtstore():
+    get_txtstore_queue()
     return render_template("txtstore.html")
 
 @misc_bp.route("/txtstore/save", methods=["POST"])
 def txtstore_save():
     text = request.form.get("text", "")
+    # ローカルに保存した時点で応答し、GASへはバックグラウンドで送る
     try:
-        res = requests.post(
-            "https://script.google.com/macros/s/AKfycbwms2TFCe_m-uHQsaJUZ3SQbWKddtFm413BSNblBAKwxP2faJkz47DAYx2Vwb2zXL2p/exec",
-            data={"text": text},
-            timeout=5
-        )
-        res.raise_for_status()
-    except Exception as e:
+        get_txtstore_queue().put({"text": text})
+    except sqlite3.Error as e:
         return f"保存失敗: {e}", 500
-    return "保存しました（外部）"
+    return "保存しました（外部へは順次送信します）"
+
+@misc_bp.route("/txtstore/status")
+def txtstore_status():
+    # GASへの送信待ちの件数や直近の失敗を確認する
+    return jsonify(get_txtstore_queue().status())
+
+@misc_bp.route("/metrics")
+def metrics():
+    # 外部APIへの接続状況と、まとめられた問い合わせの件数（このワーカープロセス分）
+    return jsonify({"http": http_metrics(), "single_flight": single_flight_metrics()})
 
 @misc_bp.route("/mainkurafuto")
 def mainkurafuto():
@@ -0,0 +1,301 @@
+import os
+import csv
+import json
+import re
+import sys
+import pickle
+import random
+import threading
+from collections import namedtuple
+
+# プロジェクトのルートディレクトリ（sentences*.json / words.json の置き場所）
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 事前コンパイル済みデータ（build-corpus で作成）の置き場所と形式の版
+ARTIFACT_PATH = os.getenv('QUIZ_ARTIFACT_PATH', os.path.join(BASE_DIR, 'corpus.pickle'))
+ARTIFACT_FORMAT = 2
+
+# 空欄（[word]）を表すパターン
+BLANK_PATTERN = re.compile(r'\[[a-zA-Z\s\']+\]')
+
+# 万が一ファイルがない場合のフォールバック（デモデータ）
+DEMO_SENTENCES = [
+    {"chapter": "1", "number": "1", "question_number": "1", "sentence": "The researchers [accumulated] hundreds of photographs of irregular plant growth caused by chemical fertilizers."},
+    {"chapter": "1", "number": "1", "question_number": "2", "sentence": "An [accumulation] of small misfortunes eventually [led] to the government's collapse."},
+    {"chapter": "1", "number": "2", "question_number": "1", "sentence": "Colonialists often see themselves as bringing [civilization] to less fortunate peoples."},
+    {"chapter": "1", "number": "2", "question_number": "2", "sentence": "The society which produced the pyramids certainly deserves to be called a [civilization]."},
+    {"chapter": "1", "number": "3", "question_number": "1", "sentence": "The moon hoax theory claims that people have never traveled to the moon."}
+]
+
+DEMO_WORDS = [
+    {"chapter": "1", "number": "1", "words": ["accumulate"]},
+    {"chapter": "1", "number": "2", "words": ["civilization"]},
+    {"chapter": "1", "number": "3", "words": ["claim"]}
+]
+
+
+# 空欄付き英文を事前に分解したもの
+#   segments:      空欄以外の文字列（len(answers) + 1 個）
+#   answers:       空欄の正解
+#   answers_lower: 判定用に小文字化した正解
+#   text:          空欄を __INPUT_i__ に置き換えた英文（画面表示用）
+SentenceTemplate = namedtuple('SentenceTemplate', ['segments', 'answers', 'answers_lower', 'text'])
+
+
+def compile_sentence(sentence):
+    """英文を1回走査して SentenceTemplate に変換する"""
+    segments = []
+    answers = []
+    pos = 0
+    for m in BLANK_PATTERN.finditer(sentence):
+        segments.append(sentence[pos:m.start()])
+        answers.append(m.group()[1:-1])
+        pos = m.end()
+    segments.append(sentence[pos:])
+
+    parts = [segments[0]]
+    for i, seg in enumerate(segments[1:]):
+        parts.append(f"__INPUT_{i}__")
+        parts.append(seg)
+
+    return SentenceTemplate(
+        segments=tuple(segments),
+        answers=tuple(answers),
+        answers_lower=tuple(a.lower() for a in answers),
+        text=''.join(parts),
+    )
+
+
+def question_id(question):
+    """問題の固定ID（"章-節-問題番号"）。問題ファイルが更新されて並び順が変わっても変わらない"""
+    return f"{question['chapter']}-{question['number']}-{question['question_number']}"
+
+
+def _file_version(path):
+    """ファイルの更新時刻（ns）を返す。存在しない場合は None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _intern_record(record):
+    # キーと短い値（chapter / number など）は同じ文字列を共有させる
+    return {
+        sys.intern(k): sys.intern(v) if isinstance(v, str) and len(v) <= 16 else v
+        for k, v in record.items()
+    }
+
+
+def _load_json(path, fallback):
+    if not os.path.exists(path):
+        return fallback
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f, object_hook=_intern_record)
+
+
+class WordIndex:
+    """ヒント単語の索引（全問題セットで共有する読み取り専用データ）
+
+    section_words: (chapter, number) → その節の単語（words.json 由来）
+    vocab: ダミー候補になる全単語を重複なしで並べた配列
+    """
+
+    def __init__(self, words, extra_vocab=(), version=None):
+        self.version = version
+
+        section_words = {}
+        vocab = {}  # 挿入順を保った重複排除
+        for w in words:
+            key = (str(w['chapter']), str(w['number']))
+            section = [sys.intern(word) for word in w['words']]
+            section_words.setdefault(key, {}).update(dict.fromkeys(section))
+            vocab.update(dict.fromkeys(section))
+        # 追加語彙（words.csv など）はダミー候補としてのみ使う
+        vocab.update(dict.fromkeys(sys.intern(word) for word in extra_vocab))
+
+        self.section_words = {k: frozenset(v) for k, v in section_words.items()}
+        self.vocab = tuple(vocab)
+
+    def hint_words_for(self, question):
+        """問題と同じChapter/Numberに属する単語（正解の原形候補）"""
+        key = (str(question['chapter']), str(question['number']))
+        return self.section_words.get(key, frozenset())
+
+    def sample_distractors(self, exclude, k):
+        """exclude に含まれない単語を k 語ランダムに選ぶ
+
+        語彙配列の添字を乱択し、除外語・重複は棄却して引き直す。
+        語彙の大きさに関係なく k に比例した手間で済む。
+        """
+        vocab = self.vocab
+        n = len(vocab)
+        picked = []
+        if k <= 0 or n == 0:
+            return picked
+
+        seen = set(exclude)
+        attempts = 0
+        max_attempts = k * 8 + 32
+        while len(picked) < k and attempts < max_attempts:
+            attempts += 1
+            w = vocab[random.randrange(n)]
+            if w in seen:
+                continue
+            seen.add(w)
+            picked.append(w)
+
+        # 語彙がほとんど除外語で埋まっている場合のみ全体を走査して補う
+        if len(picked) < k:
+            rest = [w for w in vocab if w not in seen]
+            random.shuffle(rest)
+            picked.extend(rest[:k - len(picked)])
+        return picked
+
+
+class QuizCorpus:
+    """1つの問題セットを前処理した読み取り専用のデータ
+
+    全リクエストで共有されるため、生成後に中身を書き換えてはいけない。
+    """
+
+    def __init__(self, sentences, words, version=None):
+        self.version = version
+        # ヒント単語の索引（全セット共通の WordIndex）
+        self.words = words
+
+        # 1. 出題可能な問題をプール
+        self.quiz_pool = tuple(s for s in sentences if BLANK_PATTERN.search(s['sentence']))
+
+        # 2. 各問題の英文をテンプレート（表示用の文・正解・判定用の正解）に分解しておく
+        self.templates = tuple(compile_sentence(q['sentence']) for q in self.quiz_pool)
+
+        # 固定ID → 問題位置（解答の判定は位置ではなく固定IDで問題を引く）
+        self.question_ids = tuple(sys.intern(question_id(q)) for q in self.quiz_pool)
+        self.positions = {}
+        for idx, qid in enumerate(self.question_ids):
+            self.positions.setdefault(qid, idx)
+
+        # 3. サイドバー用の階層構造ツリー
+        sidebar_tree = {}
+        for idx, q in enumerate(self.quiz_pool):
+            sections = sidebar_tree.setdefault(q['chapter'], {})
+            sections.setdefault(q['number'], []).append({
+                'idx': idx,
+                'q_num': q['question_number']
+            })
+        self.sidebar_tree = sidebar_tree
+
+
+# ファイル名ごとのキャッシュ: key -> 構築済みオブジェクト
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _get_cached(key, version, build):
+    """version が変わった場合のみ build(version) で再構築する"""
+    obj = _cache.get(key)
+    if obj is not None and obj.version == version:
+        return obj
+
+    with _cache_lock:
+        # 他のスレッドが先に再構築していればそれを使う
+        obj = _cache.get(key)
+        if obj is not None and obj.version == version:
+            return obj
+        obj = build(version)
+        _cache[key] = obj
+        return obj
+
+
+def _load_csv_vocab(path):
+    """単語帳CSV（id,英単語,和訳）の英単語列を読み込む"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [row[1].strip() for row in csv.reader(f) if len(row) > 1 and row[1].strip()]
+
+
+def get_word_index(words_file='words.json', distractor_file=None):
+    """全問題セットで共有するヒント単語索引を返す
+
+    distractor_file を指定すると（既定は環境変数 QUIZ_DISTRACTOR_CSV、例: words.csv）
+    その語彙もダミー候補に加える。
+    """
+    if distractor_file is None:
+        distractor_file = os.getenv('QUIZ_DISTRACTOR_CSV', '')
+    words_path = os.path.join(BASE_DIR, words_file)
+    distractor_path = os.path.join(BASE_DIR, distractor_file) if distractor_file else ''
+
+    def build(version):
+        words = _load_json(words_path, DEMO_WORDS)
+        return WordIndex(words, _load_csv_vocab(distractor_path), version)
+
+    version = (_file_version(words_path), _file_version(distractor_path) if distractor_path else None)
+    return _get_cached(('words', words_file, distractor_file), version, build)
+
+
+def get_corpus(sentences_file, words_file='words.json'):
+    """問題セットのコーパスを返す（初回のみ読み込み、ファイル更新時に再構築）"""
+    words = get_word_index(words_file)
+    sentences_path = os.path.join(BASE_DIR, sentences_file)
+
+    def build(version):
+        return QuizCorpus(_load_json(sentences_path, DEMO_SENTENCES), words, version)
+
+    # words.json が更新された場合も新しい WordIndex を参照するよう再構築する
+    version = (_file_version(sentences_path), words.version)
+    return _get_cached(('sentences', sentences_file), version, build)
+
+
+# =========================
+# 事前コンパイル（デプロイ時に1回だけ実行し、起動時は1回の unpickle で読み込む）
+#
+# 保存するのは構築済みの QuizCorpus / WordIndex / Vocabulary そのもの。
+# 各オブジェクトは元ファイルの version を持っているため、起動後に元ファイルが
+# 更新された場合は通常どおり読み直される（古いデータが使われ続けることはない）。
+# =========================
+
+def build_artifact(sentence_files, words_file='words.json', vocab_file='words.csv', path=ARTIFACT_PATH):
+    """指定した問題セット・単語帳を構築して1つのファイルに保存する"""
+    from routes.vocabulary import get_vocabulary
+
+    with _cache_lock:
+        _cache.clear()
+    for sentences_file in sentence_files:
+        get_corpus(sentences_file, words_file)
+
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'quiz_cache': dict(_cache),
+        'vocabulary': {vocab_file: get_vocabulary(vocab_file)},
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_artifact(path=ARTIFACT_PATH):
+    """事前コンパイル済みデータがあればキャッシュに読み込む。読み込めたら True"""
+    from routes.vocabulary import preload_vocabulary
+
+    try:
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        print(f"⚠️ {path} を読み込めませんでした（通常の読み込みを使います）: {e}")
+        return False
+    if not isinstance(artifact, dict) or artifact.get('format') != ARTIFACT_FORMAT:
+        print(f"⚠️ {path} の形式が古いため使いません（build-corpus で作り直してください）")
+        return False
+
+    with _cache_lock:
+        for key, obj in artifact['quiz_cache'].items():
+            _cache.setdefault(key, obj)
+    for vocab_file, vocab in artifact['vocabulary'].items():
+        preload_vocabulary(vocab_file, vocab)
+    return True
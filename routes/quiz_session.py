@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from flask import request, session, after_this_request
+from routes.local_db import ThreadLocalSqlite, lazy_singleton
+
+# =========================
+# クイズの出題状態（現在の問題）の保存先
+#
+#   QUIZ_SESSION_BACKEND=cookie  … Flask の署名付きCookieに保存（既定）
+#   QUIZ_SESSION_BACKEND=memory  … プロセス内LRU（TTL付き）。CookieはセッションIDのみ
+#   QUIZ_SESSION_BACKEND=sqlite  … ローカルのSQLiteファイル。gunicornの複数ワーカーで共有可
+# =========================
+SESSION_COOKIE = 'quiz_sid'
+SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', str(6 * 60 * 60)))
+SESSION_MAX_ENTRIES = int(os.getenv('QUIZ_SESSION_MAX', '10000'))
+SESSION_DB_PATH = os.getenv(
+    'QUIZ_SESSION_DB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'quiz_sessions.sqlite3')
+)
+
+
+class MemorySessionStore:
+    """プロセス内のLRUストア（最大件数と有効期限で古いものから捨てる）"""
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, ttl=SESSION_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # sid -> (期限, 値)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < now:
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return value
+
+    def set(self, sid, value):
+        now = time.monotonic()
+        with self._lock:
+            self._data[sid] = (now + self.ttl, value)
+            self._data.move_to_end(sid)
+            # 期限切れ → 最も古いものの順に件数上限まで削除
+            while self._data:
+                oldest_sid, (expires, _) = next(iter(self._data.items()))
+                if expires >= now and len(self._data) <= self.max_entries:
+                    break
+                del self._data[oldest_sid]
+
+
+class SqliteSessionStore:
+    """SQLiteファイルに保存するストア（同じマシン上のワーカー間で共有される）"""
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = ThreadLocalSqlite(path, timeout=5)
+        self._writes = 0
+        with self._db.connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS quiz_session '
+                '(sid TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+
+    def get(self, sid):
+        row = self._db.connect().execute(
+            'SELECT value, expires FROM quiz_session WHERE sid = ?', (sid,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, sid, value):
+        now = time.time()
+        with self._db.connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO quiz_session (sid, value, expires) VALUES (?, ?, ?)',
+                (sid, json.dumps(value), now + self.ttl)
+            )
+            # たまに期限切れの行を掃除する
+            self._writes += 1
+            if self._writes % 500 == 0:
+                conn.execute('DELETE FROM quiz_session WHERE expires < ?', (now,))
+
+
+# バックエンド名 → ストアの生成関数（独自のストアを追加する場合はここに登録）
+SESSION_BACKENDS = {
+    'memory': MemorySessionStore,
+    'sqlite': SqliteSessionStore,
+}
+
+def _session_backend():
+    return os.getenv('QUIZ_SESSION_BACKEND', 'cookie')
+
+
+_server_store = lazy_singleton(lambda: SESSION_BACKENDS[_session_backend()]())
+
+
+def get_store():
+    """サーバー側ストアを返す。cookie バックエンドの場合は None"""
+    if _session_backend() not in SESSION_BACKENDS:
+        return None
+    return _server_store()
+
+
+def _session_id(create):
+    sid = request.cookies.get(SESSION_COOKIE)
+    if sid or not create:
+        return sid
+
+    sid = secrets.token_urlsafe(16)
+
+    @after_this_request
+    def set_sid_cookie(response):
+        response.set_cookie(SESSION_COOKIE, sid, max_age=SESSION_TTL, httponly=True, samesite='Lax')
+        return response
+
+    return sid
+
+
+def save_current_question(value):
+    """現在の問題（[set_key, 問題の固定ID]）を保存する"""
+    store = get_store()
+    if store is None:
+        session['current_question'] = value
+        return
+    store.set(_session_id(create=True), value)
+
+
+def load_current_question():
+    """保存されている現在の問題を返す（なければ None）"""
+    store = get_store()
+    if store is None:
+        return session.get('current_question')
+    sid = _session_id(create=False)
+    if not sid:
+        return None
+    return store.get(sid)
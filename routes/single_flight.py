@@ -0,0 +1,88 @@
+import threading
+
+# =========================
+# 同じ問い合わせの同時実行をまとめる（single-flight）
+#
+# 同じキーの問い合わせが実行中であれば、新たに問い合わせずにその結果を待って共有する。
+# 完了した結果は保持しない（キャッシュは呼び出し側の役割）。集計は /metrics で確認できる。
+# =========================
+
+
+class _Call:
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "executed": 0, "shared": 0, "errors": 0}
+
+    def acquire(self, key):
+        """(呼び出し, 自分が実行するか) を返す。True の場合は必ず resolve() すること"""
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["shared"] += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self._stats["executed"] += 1
+            return call, True
+
+    def resolve(self, key, call, result=None, error=None):
+        """実行した結果（または例外）を待っている呼び出しに渡す"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if error is not None:
+                self._stats["errors"] += 1
+        call.result = result
+        call.error = error
+        call._done.set()
+
+    def do(self, key, fn):
+        """fn() を実行して結果を返す。同じキーで実行中のものがあればその結果を返す"""
+        call, leader = self.acquire(key)
+        if not leader:
+            return call.wait()
+        try:
+            result = fn()
+        except Exception as e:
+            self.resolve(key, call, error=e)
+            raise
+        self.resolve(key, call, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    """名前ごとの SingleFlight を返す（同じ名前は同じものを共有する）"""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = SingleFlight(name)
+            _flights[name] = flight
+        return flight
+
+
+def single_flight_metrics():
+    return {name: flight.stats() for name, flight in sorted(_flights.items())}
@@ -1,22 +1,17 @@
-import csv
-import requests
-from flask import Blueprint, render_template, jsonify, request
+import json
+from flask import Blueprint, Response, render_template, jsonify, request
+from routes.study_progress import get_progress_store
+from routes.vocabulary import get_vocabulary
 
 # Blueprintの設定
 study_bp = Blueprint('study', __name__)
 
 CSV_FILE = 'words.csv'
-GAS_URL = 'https://script.google.com/macros/s/AKfycbyRk25abgQ2T8W-r7U9CJ9qJq5j79UqTtA0Aml7vTeEbKqYoTYNHj0yfGkJkSEqRGI-FQ/exec'
-
-def fetch_words():
-    words = []
-    try:
-        with open(CSV_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            words = list(reader)
-    except FileNotFoundError:
-        pass
-    return words
+# /api/get_words で1回に返す単語数（既定・上限）
+WORDS_PAGE_DEFAULT = 500
+WORDS_PAGE_MAX = 2000
+# 進捗がローカルになく、GASからも取得できなかったときの応答
+PROGRESS_UNAVAILABLE = '進捗を取得できませんでした。しばらくしてから再読み込みしてください。'
 
 @study_bp.route('/study')
 def study_page():
@@ -24,20 +19,19 @@ def study_page():
 
 @study_bp.route('/api/get_word')
 def get_word():
-    # 1. GASから現在の進捗を取得
-    res = requests.get(GAS_URL)
-    current_index = res.json().get('index', 0)
+    # 1. 現在の進捗を取得（ローカルに保存済みの値。初回のみGASから取得）
+    current_index = get_progress_store().get_index()
+    if current_index is None:
+        return jsonify({'error': PROGRESS_UNAVAILABLE}), 503
     
-    # 2. CSV読み込み
-    words = fetch_words()
+    # 2. 単語帳（読み込み済みのもの）
+    vocab = get_vocabulary(CSV_FILE)
     
-    if current_index < len(words):
+    if current_index < len(vocab):
         return jsonify({
-            'id': words[current_index][0],
-            'en': words[current_index][1],
-            'jp': words[current_index][2],
+            **vocab.word(current_index),
             'index': current_index,
-            'total': len(words)
+            'total': len(vocab)
         })
     return jsonify({'error': 'Finished'})
 
@@ -45,31 +39,68 @@ def get_word():
 def submit():
     data = request.json # {status, word_id, current_index}
     
-    # GASへ進捗更新と単語記録をまとめて送信
-    payload = {
-        'next_index': data['current_index'] + 1,
-        'word_id': data['word_id'],
-        'status': data['status']
-    }
-    requests.post(GAS_URL, json=payload)
-    
+    # 進捗をローカルに保存し、GASへの進捗更新と単語記録は送信待ちに積む
+    # 進捗が分からないうちは記録しない（GAS側の進捗を上書きしないため）
+    if get_progress_store().record(data['word_id'], data['status'], data['current_index']) is None:
+        return jsonify({'error': PROGRESS_UNAVAILABLE}), 503
+
     return jsonify({'status': 'ok'})
 
 
+@study_bp.route('/api/sync_status')
+def sync_status():
+    # GASへの送信待ちの件数や直近の失敗を確認する
+    return jsonify(get_progress_store().sync_status())
+
+
+@study_bp.route('/api/get_progress')
+def get_progress():
+    current_index = get_progress_store().get_index()
+    if current_index is None:
+        return jsonify({'error': PROGRESS_UNAVAILABLE}), 503
+    vocab = get_vocabulary(CSV_FILE)
+    return jsonify({
+        'current_index': current_index,
+        'total': len(vocab),
+        'etag': vocab.etag
+    })
+
+
+@study_bp.route('/api/get_words')
+def get_words():
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', WORDS_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({'error': 'offset と limit は整数で指定してください'}), 400
+    if offset < 0 or not 1 <= limit <= WORDS_PAGE_MAX:
+        return jsonify({'error': f'offset は0以上、limit は1〜{WORDS_PAGE_MAX}で指定してください'}), 400
+
+    vocab = get_vocabulary(CSV_FILE)
+    # 単語帳が変わらない限り同じ内容なので、ブラウザのキャッシュと照合して304を返す
+    etag = f'{vocab.etag}-{offset}-{limit}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({
+            'words': vocab.page(offset, limit),
+            'offset': offset,
+            'limit': limit,
+            'total': len(vocab)
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @study_bp.route('/api/get_all_data')
 def get_all_data():
-    # 1. GASから進捗を取得
-    res = requests.get(GAS_URL)
-    current_index = res.json().get('index', 0)
-    
-    # 2. CSVを全読み込み
-    words = []
-    with open(CSV_FILE, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            words.append({'id': row[0], 'en': row[1], 'jp': row[2]})
+    # 1. 進捗を取得
+    current_index = get_progress_store().get_index()
+    if current_index is None:
+        return jsonify({'error': PROGRESS_UNAVAILABLE}), 503
     
-    return jsonify({
-        'words': words,
-        'current_index': current_index
-    })
+    # 2. 単語一覧は読み込み時に作ったJSONをそのまま埋め込む
+    vocab = get_vocabulary(CSV_FILE)
+    body = '{"words": ' + vocab.words_json + ', "current_index": ' + json.dumps(current_index) + '}'
+    return Response(body, mimetype='application/json')
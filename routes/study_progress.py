@@ -0,0 +1,115 @@
+import os
+import time
+import requests
+from routes.http_client import register_upstream
+from routes.single_flight import get_single_flight
+from routes.local_db import ThreadLocalSqlite, lazy_singleton
+from routes.write_behind import WriteBehindQueue, post_each
+
+# =========================
+# 単語学習の進捗（次に出す単語の位置）の保存先
+#
+# 進捗はローカルのSQLiteファイルで管理し、読み込みはGASに問い合わせずに返す。
+# GASへの記録（進捗更新と単語の結果）は送信待ちキューに積み、バックグラウンドでまとめて送る。
+# GASに問い合わせるのは、ローカルに進捗がまだない最初の1回だけ。
+# その1回でGASから取得できなかった場合は進捗不明（None）とし、回答の記録も受け付けない
+# （0 から記録し直すとGAS側の本来の進捗を上書きしてしまうため）。
+# =========================
+GAS_URL = 'https://script.google.com/macros/s/AKfycbyRk25abgQ2T8W-r7U9CJ9qJq5j79UqTtA0Aml7vTeEbKqYoTYNHj0yfGkJkSEqRGI-FQ/exec'
+STUDY_DB_PATH = os.getenv(
+    'STUDY_DB_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'study_progress.sqlite3')
+)
+# 1回の送信処理でまとめて送る件数
+STUDY_SYNC_BATCH = int(os.getenv('STUDY_SYNC_BATCH', '20'))
+
+# GAS（misc の txtstore と共有。接続プール・タイムアウト・ブレーカーは http_client 側）
+gas_client = register_upstream('gas')
+# 同時に来た進捗の読み込みは1回の問い合わせにまとめる
+progress_reads = get_single_flight('gas_progress')
+
+
+def fetch_remote_index():
+    """GASに保存されている進捗を取得する（取得できなければ None）"""
+    try:
+        res = gas_client.get(GAS_URL)
+        res.raise_for_status()
+        return int(res.json().get('index', 0))
+    except (requests.RequestException, ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ GASから進捗を取得できませんでした: {e}")
+        return None
+
+
+def post_progress(payload):
+    res = gas_client.post(GAS_URL, json=payload)
+    res.raise_for_status()
+
+
+def post_progress_batch(payloads):
+    """送信待ちの記録を古い順にGASへ送る（GASは1件ずつ受け付けるため順番に送る）"""
+    return post_each(payloads, post_progress)
+
+
+class StudyProgressStore:
+    def __init__(self, path=STUDY_DB_PATH):
+        self.path = path
+        self._db = ThreadLocalSqlite(path, timeout=10)
+        with self._db.connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS study_progress '
+                '(key TEXT PRIMARY KEY, value INTEGER NOT NULL, updated_at REAL NOT NULL)'
+            )
+        self.outbox = WriteBehindQueue('study', path, post_progress_batch, batch_size=STUDY_SYNC_BATCH)
+
+    def _read_index(self):
+        row = self._db.connect().execute(
+            "SELECT value FROM study_progress WHERE key = 'index'"
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _write_index(self, index, only_if_missing=False):
+        verb = 'INSERT OR IGNORE' if only_if_missing else 'INSERT OR REPLACE'
+        with self._db.connect() as conn:
+            conn.execute(
+                f"{verb} INTO study_progress (key, value, updated_at) VALUES ('index', ?, ?)",
+                (index, time.time())
+            )
+
+    def get_index(self):
+        """現在の進捗を返す（ローカルになく、GASからも取得できなければ None）"""
+        # 前回の起動時に送り残した記録があれば送信を再開する
+        self.outbox.ensure_started()
+        index = self._read_index()
+        if index is not None:
+            return index
+
+        # ローカルに進捗がない場合だけGASから取得する（同時に来ても問い合わせは1回）
+        remote = progress_reads.do(GAS_URL, fetch_remote_index)
+        if remote is None:
+            # 取得できなかった場合は保存せず、次回もう一度問い合わせる
+            return None
+        # 他のリクエスト・ワーカーが先に進捗を書いていたらそちらを優先する
+        self._write_index(remote, only_if_missing=True)
+        return self._read_index()
+
+    def record(self, word_id, status, current_index):
+        """回答を記録して進捗を進める（GASへの送信は後で行う）
+
+        進捗がまだ分からない場合は何も記録せず None を返す。
+        """
+        if self.get_index() is None:
+            return None
+        next_index = current_index + 1
+        self._write_index(next_index)
+        self.outbox.put({
+            'next_index': next_index,
+            'word_id': word_id,
+            'status': status,
+        })
+        return next_index
+
+    def sync_status(self):
+        return self.outbox.status()
+
+
+get_progress_store = lazy_singleton(StudyProgressStore)
@@ -1,124 +1,97 @@
-import os
-import json
-import re
 import random
-from flask import Blueprint, render_template, request, jsonify, session
+import click
+from flask import Blueprint, render_template, request, jsonify, abort
+from markupsafe import Markup
+from routes.quiz_corpus import get_corpus, build_artifact, ARTIFACT_PATH
+from routes.quiz_session import save_current_question, load_current_question
 
 ut_eitan_quiz_bp = Blueprint(
     'ut_eitan_quiz',
     __name__,
-    url_prefix='/ut-eitan-quiz',
     template_folder='../templates'
 )
 
-# JSONデータの読み込み関数
-def load_data():
-    # 実行環境のパスに合わせて調整できるようにする
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
-    sentences_path = os.path.join(base_dir, 'sentences.json')
-    words_path = os.path.join(base_dir, 'words.json')
-    
-    # 万が一ファイルがない場合のフォールバック（デモデータ）
-    if not os.path.exists(sentences_path):
-        sentences = [
-            {"chapter": "1", "number": "1", "question_number": "1", "sentence": "The researchers [accumulated] hundreds of photographs of irregular plant growth caused by chemical fertilizers."},
-            {"chapter": "1", "number": "1", "question_number": "2", "sentence": "An [accumulation] of small misfortunes eventually [led] to the government's collapse."},
-            {"chapter": "1", "number": "2", "question_number": "1", "sentence": "Colonialists often see themselves as bringing [civilization] to less fortunate peoples."},
-            {"chapter": "1", "number": "2", "question_number": "2", "sentence": "The society which produced the pyramids certainly deserves to be called a [civilization]."},
-            {"chapter": "1", "number": "3", "question_number": "1", "sentence": "The moon hoax theory claims that people have never traveled to the moon."}
-        ]
-    else:
-        with open(sentences_path, 'r', encoding='utf-8') as f:
-            sentences = json.load(f)
-            
-    if not os.path.exists(words_path):
-        # 【修正】フォールバック用デモデータも配列形式 ("words") に修正
-        words = [
-            {"chapter": "1", "number": "1", "words": ["accumulate"]},
-            {"chapter": "1", "number": "2", "words": ["civilization"]},
-            {"chapter": "1", "number": "3", "words": ["claim"]}
-        ]
-    else:
-        with open(words_path, 'r', encoding='utf-8') as f:
-            words = json.load(f)
-            
-    return sentences, words
+# =========================
+# 問題セットの登録簿
+# セットを追加する場合はここに1件追加するだけでよい
+# =========================
+QUIZ_SETS = [
+    {'key': 'main', 'url_prefix': '/ut-eitan-quiz', 'sentences': 'sentences.json',
+     'title': '東大英単クイズ', 'storage_key': 'ut_eitan_quiz_progress_2026'},
+    {'key': '1', 'url_prefix': '/ut-eitan-quiz-1', 'sentences': 'sentences_1.json',
+     'title': '東大英単クイズ(一章)', 'storage_key': 'ut_eitan_quiz_progress_2026_1'},
+    {'key': '2', 'url_prefix': '/ut-eitan-quiz-2', 'sentences': 'sentences_2.json',
+     'title': '東大英単クイズ(二章)', 'storage_key': 'ut_eitan_quiz_progress_2026_2'},
+    {'key': '3', 'url_prefix': '/ut-eitan-quiz-3', 'sentences': 'sentences_3.json',
+     'title': '東大英単クイズ(三章)', 'storage_key': 'ut_eitan_quiz_progress_2026_3'},
+    {'key': '4', 'url_prefix': '/ut-eitan-quiz-4', 'sentences': 'sentences_4.json',
+     'title': '東大英単クイズ(四章)', 'storage_key': 'ut_eitan_quiz_progress_2026_4'},
+    {'key': '5', 'url_prefix': '/ut-eitan-quiz-5', 'sentences': 'sentences_5.json',
+     'title': '東大英単クイズ(五章)', 'storage_key': 'ut_eitan_quiz_progress_2026_5'},
+    {'key': '6', 'url_prefix': '/ut-eitan-quiz-6', 'sentences': 'sentences_6.json',
+     'title': '東大英単クイズ(六章)', 'storage_key': 'ut_eitan_quiz_progress_2026_6'},
+]
+QUIZ_SETS_BY_KEY = {qs['key']: qs for qs in QUIZ_SETS}
 
 
-@ut_eitan_quiz_bp.route('/')
-def quiz_home():
-    sentences, words = load_data()
-    
-    pattern = re.compile(r'\[[a-zA-Z\s\']+\]')
-    quiz_pool = []
-    
-    # 1. 出題可能な問題をプール
-    for s in sentences:
-        if pattern.search(s['sentence']):
-            quiz_pool.append(s)
-            
+def get_quiz_set(set_key):
+    quiz_set = QUIZ_SETS_BY_KEY.get(set_key)
+    if quiz_set is None:
+        abort(404)
+    return quiz_set
+
+
+# 描画済みサイドバーのキャッシュ: set_key -> (corpus, HTML)
+_sidebar_cache = {}
+
+
+def get_sidebar_html(quiz_set, corpus):
+    """問題ナビゲーションのHTMLを返す（コーパスが更新されるまで再描画しない）"""
+    cached = _sidebar_cache.get(quiz_set['key'])
+    if cached is not None and cached[0] is corpus:
+        return cached[1]
+
+    html = Markup(render_template(
+        'ut_eitan_quiz/_sidebar.html',
+        sidebar_tree=corpus.sidebar_tree,
+        url_prefix=quiz_set['url_prefix']
+    ))
+    _sidebar_cache[quiz_set['key']] = (corpus, html)
+    return html
+
+
+def quiz_home(set_key):
+    quiz_set = get_quiz_set(set_key)
+    # 前処理済みのコーパス（プロセス内で共有、ファイル更新時のみ再読み込み）
+    corpus = get_corpus(quiz_set['sentences'])
+    quiz_pool = corpus.quiz_pool
+
     if not quiz_pool:
         return "有効なクイズ問題が見つかりませんでした。"
-    
-    # 2. サイドバー用の階層構造ツリーを作る
-    sidebar_tree = {}
-    for idx, q in enumerate(quiz_pool):
-        ch = q['chapter']
-        num = q['number']
-        q_num = q['question_number']
-        
-        if ch not in sidebar_tree:
-            sidebar_tree[ch] = {}
-        if num not in sidebar_tree[ch]:
-            sidebar_tree[ch][num] = []
-            
-        sidebar_tree[ch][num].append({
-            'idx': idx,
-            'q_num': q_num
-        })
 
-    # 3. 現在の問題インデックスを取得
+    # 現在の問題インデックスを取得
     q_idx = request.args.get('q', default=None, type=int)
     if q_idx is None or q_idx < 0 or q_idx >= len(quiz_pool):
         q_idx = random.randint(0, len(quiz_pool) - 1)
         
     question = quiz_pool[q_idx]
-    original_sentence = question["sentence"]
-    
-    raw_targets = pattern.findall(original_sentence)
-    targets = [re.sub(r'[\[\]]', '', t) for t in raw_targets]
-    
-    replaced_sentence = original_sentence
-    for i, target in enumerate(raw_targets):
-        replaced_sentence = replaced_sentence.replace(target, f"__INPUT_{i}__", 1)
+    # 読み込み時に分解済みのテンプレート（空欄置換済みの英文・正解）
+    template = corpus.templates[q_idx]
         
     # ========================================================
     # 【修正方法A対応】ヒント単語の抽出ロジック（常にぴったり10語）
     # ========================================================
     
-    # 1. 現在の問題と同じChapter/Numberに属する単語（正解の原形候補）をすべて抽出
-    correct_hints = set()
-    for w in words:
-        if str(w['chapter']) == str(question['chapter']) and str(w['number']) == str(question['number']):
-            # w['words'] 内の要素を update() で一括展開して追加
-            correct_hints.update(w['words'])
-            
-    # 2. ダミー単語のプール（正解セクションに含まれない他のすべての単語）を作成
-    all_words = set()
-    for w in words:
-        all_words.update(w['words'])
-        
-    dummy_pool = [dw for dw in all_words if dw not in correct_hints]
-    random.shuffle(dummy_pool)
+    # 1. 現在の問題と同じChapter/Numberに属する単語（正解の原形候補）を索引から取得
+    correct_hints = corpus.words.hint_words_for(question)
     
-    # 3. 常に10語ぴったりになるように調整
+    # 2. 常に10語ぴったりになるように調整
     hint_set = set(correct_hints)
     
     if len(hint_set) > 10:
         # 【ケースA】同じセクションの単語だけで10語を超えている場合
         # 今回の空欄（targets）に使われている単語と関連性が高いものを優先して10語に絞り込む
-        target_lowers = [t.lower() for t in targets]
+        target_lowers = template.answers_lower
         priority_hints = []
         other_hints = []
         
@@ -135,53 +108,59 @@ def quiz_home():
         
     else:
         # 【ケースB】10語に満たない場合（通常はこちら）
-        # ぴったり10語になるまで、シャッフルしたダミープールから単語を補充
-        for dw in dummy_pool:
-            if len(hint_set) >= 10:
-                break
-            hint_set.add(dw)
+        # ぴったり10語になるまで、正解セクション以外の語彙から乱択したダミー単語を補充
         hint_list = list(hint_set)
+        hint_list.extend(corpus.words.sample_distractors(hint_set, 10 - len(hint_list)))
         
-    # 4. 最後に順番をランダムにシャッフル（正解がどこにあるか分からなくするため）
+    # 3. 最後に順番をランダムにシャッフル（正解がどこにあるか分からなくするため）
     random.shuffle(hint_list)
     
     # === 修正ここまで ===
     
-    session['current_targets'] = targets
+    # セッションには正解そのものではなく問題の固定IDだけを保存する
+    # （問題ファイルが更新されて位置がずれても同じ問題で判定できる。
+    #   QUIZ_SESSION_BACKEND でサーバー側ストアに切り替え可能）
+    save_current_question([set_key, corpus.question_ids[q_idx]])
     
-    # 4. sidebar_tree を追加してレンダリング
+    # 4. キャッシュ済みのサイドバーを埋め込んでレンダリング
     return render_template(
         'ut_eitan_quiz/quiz.html',
-        sentence_template=replaced_sentence,
+        sentence_template=template.text,
         hints=hint_list,
-        targets_count=len(targets),
+        targets_count=len(template.answers),
         chapter=question['chapter'],
         number=question['number'],
         question_number=question['question_number'],
         total_questions=len(quiz_pool),
         current_idx=q_idx,
-        sidebar_tree=sidebar_tree
+        sidebar_html=get_sidebar_html(quiz_set, corpus),
+        quiz_title=quiz_set['title'],
+        url_prefix=quiz_set['url_prefix'],
+        storage_key=quiz_set['storage_key']
     )
 
-@ut_eitan_quiz_bp.route('/check', methods=['POST'])
-def check_answer():
-    """解答を判定するAPI endpoint"""
-    data = request.get_json() or {}
-    user_answers = data.get('answers', [])
-    correct_answers = session.get('current_targets', [])
-    
-    if not correct_answers:
-        return jsonify({'error': 'セッションがタイムアウトしたか、問題データが存在しません。'}), 400
-        
+def find_template(corpus, question_id):
+    """問題の固定ID（"章-節-問題番号"）からテンプレートを取得する（存在しなければ None）"""
+    if not isinstance(question_id, str):
+        return None
+    idx = corpus.positions.get(question_id)
+    if idx is None:
+        return None
+    return corpus.templates[idx]
+
+
+def grade_answers(template, user_answers):
+    """テンプレートの正解とユーザーの解答を照合する"""
     results = []
     is_all_correct = True
     
-    for i, correct in enumerate(correct_answers):
+    for i, correct in enumerate(template.answers):
         # ユーザーの解答（空欄対応）
-        user_ans = user_answers[i].strip() if i < len(user_answers) else ""
+        user_ans = user_answers[i] if i < len(user_answers) else ""
+        user_ans = user_ans.strip() if isinstance(user_ans, str) else ""
         
-        # 大文字小文字を区別せずに比較
-        is_correct = user_ans.lower() == correct.lower()
+        # 大文字小文字を区別せずに比較（正解側は小文字化済み）
+        is_correct = user_ans.lower() == template.answers_lower[i]
         if not is_correct:
             is_all_correct = False
             
@@ -191,8 +170,109 @@ def check_answer():
             'correct_answer': correct,
             'is_correct': is_correct
         })
+    return is_all_correct, results
+
+
+def check_answer(set_key):
+    """解答を判定するAPI endpoint"""
+    quiz_set = get_quiz_set(set_key)
+    data = request.get_json(silent=True) or {}
+    user_answers = data.get('answers', [])
+    if not isinstance(user_answers, list):
+        user_answers = []
+
+    current = load_current_question()
+    template = None
+    if isinstance(current, list) and len(current) == 2 and current[0] == set_key:
+        template = find_template(get_corpus(quiz_set['sentences']), current[1])
+    
+    if template is None or not template.answers:
+        return jsonify({'error': 'セッションがタイムアウトしたか、問題データが存在しません。'}), 400
+        
+    is_all_correct, results = grade_answers(template, user_answers)
         
     return jsonify({
         'is_all_correct': is_all_correct,
         'results': results
     })
+
+
+# /check_batch で一度に判定できる問題数の上限
+MAX_BATCH_ITEMS = 500
+
+
+def check_batch(set_key):
+    """複数の問題をまとめて判定するAPI endpoint（ドリルモード用）
+
+    リクエスト: {"items": [{"question_id": "章-節-問題番号", "answers": [...]}, ...]}
+    セッションは使わず、question_id（例: "1-2-1"）から前処理済みコーパスの正解を引く。
+    問題の位置（?q=）ではないため、問題ファイルが更新されても別の問題と照合されることはない。
+    """
+    quiz_set = get_quiz_set(set_key)
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items に判定する問題を指定してください。'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'一度に判定できるのは {MAX_BATCH_ITEMS} 問までです。'}), 400
+
+    corpus = get_corpus(quiz_set['sentences'])
+    results = []
+    correct_count = 0
+    invalid_count = 0
+
+    for item in items:
+        if not isinstance(item, dict):
+            item = {}
+        question_id = item.get('question_id')
+        user_answers = item.get('answers', [])
+        if not isinstance(user_answers, list):
+            user_answers = []
+
+        template = find_template(corpus, question_id)
+        if template is None:
+            invalid_count += 1
+            results.append({'question_id': question_id, 'error': '問題が存在しません。'})
+            continue
+
+        is_all_correct, answer_results = grade_answers(template, user_answers)
+        if is_all_correct:
+            correct_count += 1
+        results.append({
+            'question_id': question_id,
+            'is_all_correct': is_all_correct,
+            'results': answer_results
+        })
+
+    return jsonify({
+        'results': results,
+        'total': len(items),
+        'correct': correct_count,
+        'incorrect': len(items) - correct_count - invalid_count,
+        'invalid': invalid_count
+    })
+
+
+# 登録簿の各セットについて /ut-eitan-quiz[-N]/ と /check, /check_batch のルートを登録
+for _quiz_set in QUIZ_SETS:
+    ut_eitan_quiz_bp.add_url_rule(
+        _quiz_set['url_prefix'] + '/', 'quiz_home', quiz_home,
+        defaults={'set_key': _quiz_set['key']}
+    )
+    ut_eitan_quiz_bp.add_url_rule(
+        _quiz_set['url_prefix'] + '/check', 'check_answer', check_answer,
+        defaults={'set_key': _quiz_set['key']}, methods=['POST']
+    )
+    ut_eitan_quiz_bp.add_url_rule(
+        _quiz_set['url_prefix'] + '/check_batch', 'check_batch', check_batch,
+        defaults={'set_key': _quiz_set['key']}, methods=['POST']
+    )
+
+
+@ut_eitan_quiz_bp.cli.command("build-corpus")
+@click.option("--output", default=ARTIFACT_PATH, show_default=True, help="出力先ファイル")
+def build_corpus_command(output):
+    """全問題セット・単語帳を事前コンパイルして1つのファイルに保存する（デプロイ時に実行）"""
+    path = build_artifact([quiz_set['sentences'] for quiz_set in QUIZ_SETS], path=output)
+    click.echo(f"{path} を作成しました")
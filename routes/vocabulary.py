@@ -0,0 +1,77 @@
+import os
+import csv
+import sys
+import json
+import hashlib
+import threading
+
+# =========================
+# 単語帳（words.csv: id,英単語,和訳 / ヘッダーなし）
+#
+# 初回に1回だけ読み込み、列ごとのタプルに保持する。ファイルが更新されたら読み直す。
+# 単語一覧のJSONとETagも読み込み時に作っておき、リクエストごとに作り直さない。
+# =========================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Vocabulary:
+    def __init__(self, rows, version=None):
+        rows = [row for row in rows if len(row) >= 3]
+        self.ids = tuple(sys.intern(row[0]) for row in rows)
+        self.ens = tuple(sys.intern(row[1]) for row in rows)
+        self.jps = tuple(row[2] for row in rows)
+        self.version = version
+        self.words_json = json.dumps(
+            [self.word(i) for i in range(len(self.ids))], ensure_ascii=False
+        )
+        self.etag = hashlib.sha1(self.words_json.encode('utf-8')).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def word(self, index):
+        return {'id': self.ids[index], 'en': self.ens[index], 'jp': self.jps[index]}
+
+    def page(self, offset, limit):
+        """offset 番目から limit 件の単語を返す"""
+        return [self.word(i) for i in range(offset, min(offset + limit, len(self.ids)))]
+
+
+def _file_version(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_vocabulary(csv_file='words.csv'):
+    """単語帳を返す（初回のみ読み込み、ファイル更新時に読み直す）"""
+    path = os.path.join(BASE_DIR, csv_file)
+    version = _file_version(path)
+    vocab = _cache.get(path)
+    if vocab is not None and vocab.version == version:
+        return vocab
+
+    with _cache_lock:
+        vocab = _cache.get(path)
+        if vocab is not None and vocab.version == version:
+            return vocab
+        rows = []
+        if version is not None:
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+        vocab = Vocabulary(rows, version)
+        _cache[path] = vocab
+        return vocab
+
+
+def preload_vocabulary(csv_file, vocab):
+    """事前コンパイル済みの単語帳をキャッシュに登録する（元ファイルが更新されていれば次回読み直す）"""
+    path = os.path.join(BASE_DIR, csv_file)
+    with _cache_lock:
+        _cache.setdefault(path, vocab)
@@ -1,12 +1,22 @@
-from flask import Blueprint, request, send_file, render_template
+from flask import Blueprint, Response, request, render_template, send_file, jsonify, url_for
 import io
 import csv
 import os
-import requests
+import threading
 import time
 import zoneinfo
-from datetime import datetime, timedelta
+import numpy as np
+import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
+import click
+from routes.csv_export import iter_csv_bytes, iter_error_csv_bytes, build_zip
+from routes.hotel_cache import get_hotel_cache
+from routes.background_jobs import JobManager
+from routes.http_client import CircuitOpenError, register_upstream
+from routes.single_flight import get_single_flight
 
 # Blueprintの定義
 work_optimize1_bp = Blueprint('work_optimize1', __name__)
@@ -29,20 +39,68 @@ def convert_date_to_slash_format(date_str):
     except ValueError:
         return None
 
-def get_data_from_api(facility_num, facility_name):
-    time.sleep(0.1)
+# =========================
+# 楽天APIの呼び出し設定
+# =========================
+# 同時に実行する問い合わせ（施設のまとまり）数の上限
+RAKUTEN_MAX_WORKERS = int(os.getenv("RAKUTEN_MAX_WORKERS", "4"))
+# 1回の SimpleHotelSearch で問い合わせる施設数（hotelNo はカンマ区切りで最大15件）
+RAKUTEN_BATCH_SIZE = max(1, min(15, int(os.getenv("RAKUTEN_BATCH_SIZE", "15"))))
+# 1秒あたりのAPI呼び出し回数の上限（プロセス全体で共有）
+RAKUTEN_RATE_PER_SEC = float(os.getenv("RAKUTEN_RATE_PER_SEC", "10"))
+
+
+class TokenBucket:
+    """トークンバケット方式の流量制限（複数スレッドから共有して使う）"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1つ取れるまで待つ"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+rakuten_rate_limiter = TokenBucket(RAKUTEN_RATE_PER_SEC)
+
+# 同時に同じ施設番号を問い合わせないよう、実行中の問い合わせをまとめる
+hotel_lookups = get_single_flight("rakuten_hotel")
+
+# 楽天API（接続プール・タイムアウト・再試行・ブレーカーは http_client 側。再試行も流量制限を通す）
+rakuten_client = register_upstream(
+    "rakuten",
+    pool_maxsize=RAKUTEN_MAX_WORKERS,
+    throttle=rakuten_rate_limiter.acquire,
+)
+
+
+def _request_hotels(facility_nums):
+    """施設番号（最大 RAKUTEN_BATCH_SIZE 件）をまとめて1回で問い合わせ、{施設番号: 情報} を返す
+
+    応答に含まれなかった施設番号は {"error": ...} になる。通信・APIのエラーは例外を投げる。
+    """
     app_id = os.getenv("RAKUTEN_APP_ID")
     access_key = os.getenv("RAKUTEN_ACCESS_KEY")
     affiliate_id = os.getenv("RAKUTEN_AFFILIATE_ID")
 
-    if not app_id or not affiliate_id:
-        return {"error": "APIキーが設定されていません (.env を確認してください)"}
-
     url = "https://openapi.rakuten.co.jp/engine/api/Travel/SimpleHotelSearch/20170426"
     params = {
         "format": "json",
         "responseType": "large",
-        "hotelNo": facility_num,
+        "hotelNo": ",".join(facility_nums),
         "applicationId": app_id,
         "accessKey": access_key,
         "affiliateId": affiliate_id,
@@ -53,156 +111,492 @@ def get_data_from_api(facility_num, facility_name):
         "Origin": "https://legendary-pancake-eus9.onrender.com"
     }
 
+    response = rakuten_client.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    data = response.json()
+
+    # hotels[] の順序は入力と一致するとは限らないため、hotelBasicInfo.hotelNo で対応付ける
+    found = {}
+    for entry in data.get("hotels", []):
+        parts = {}
+        for part in entry["hotel"]:
+            parts.update(part)
+        basic = parts["hotelBasicInfo"]
+        detail = parts["hotelDetailInfo"]
+        found[str(basic["hotelNo"])] = {
+            "hotelName": basic["hotelName"],
+            "middleClassCode": detail["middleClassCode"],
+            "smallClassCode": detail["smallClassCode"],
+        }
+    return {
+        num: found.get(num, {"error": f"APIエラー: 施設番号 {num} が見つかりません"})
+        for num in facility_nums
+    }
+
+def _is_rejected_params(error):
+    """楽天APIがパラメータ（施設番号）を受け付けなかったエラーか"""
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code in (400, 404)
+
+def _api_error_message(error):
+    """画面・errors.csv・ジョブの状態に出すエラー文
+
+    例外の文字列には applicationId / accessKey を含むURLが入るため使わず、
+    ステータスコードか例外の種類だけを出す。
+    """
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return f"APIエラー: HTTP {response.status_code}"
+    if isinstance(error, CircuitOpenError):
+        # ブレーカーのメッセージは自前の文言でURLを含まない
+        return f"APIエラー: {error}"
+    return f"APIエラー: {type(error).__name__}"
+
+def _fetch_batch(facility_nums):
+    """1バッチ分を問い合わせてキャッシュに保存する"""
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-
-        print(response.status_code)
-        print(response.url)
-        print(response.text)
-        response.raise_for_status()
-        data = response.json()
-
-        hotel = data["hotels"][0]["hotel"]
-        hotel_name = hotel[0]["hotelBasicInfo"]["hotelName"]
-        middle_class_code = hotel[2]["hotelDetailInfo"]["middleClassCode"]
-        small_class_code = hotel[2]["hotelDetailInfo"]["smallClassCode"]
-
-        if facility_name.strip() == hotel_name.strip():
-            return {
-                "施設番号": facility_num,
-                "施設名": hotel_name,
-                "都道府県コード": middle_class_code,
-                "市区町村コード": small_class_code,
-            }
-        else:
-            return {"error": f"施設名が一致しません: {facility_num} ({facility_name} ≠ {hotel_name})"}
+        results = _request_hotels(facility_nums)
     except Exception as e:
-        return {"error": f"APIエラー: {str(e)}"}
+        if len(facility_nums) > 1 and _is_rejected_params(e):
+            # 不正な施設番号が1つ混ざるとバッチ全体が拒否されるため、1件ずつ問い合わせ直して
+            # どの施設のエラーかを特定する
+            results = {}
+            for num in facility_nums:
+                results.update(_fetch_batch([num]))
+            return results
+        # タイムアウト・429/5xx・ブレーカーなどは1件ずつにしても結果は同じなので、全施設に同じエラーを返す
+        error = {"error": _api_error_message(e)}
+        return {num: error for num in facility_nums}
+
+    cache = get_hotel_cache()
+    for num, info in results.items():
+        if "error" not in info:
+            cache.put(num, info)
+    return results
+
+def fetch_hotel_infos(facility_nums, on_hotel_done=None):
+    """施設番号ごとのホテル情報（施設名・地区コード）を {施設番号: 情報} で返す
+
+    キャッシュにない施設だけを RAKUTEN_BATCH_SIZE 件ずつまとめて問い合わせ、
+    バッチ同士は並列に実行する。on_hotel_done(施設番号, 情報) は1施設の結果が出るたびに呼ぶ。
+    """
+    facility_nums = [str(num) for num in dict.fromkeys(facility_nums)]
+    results = {}
+
+    def done(num, info):
+        results[num] = info
+        if on_hotel_done is not None:
+            on_hotel_done(num, info)
+
+    # キャッシュはまとめて1回で引く
+    cached = get_hotel_cache().get_many(facility_nums)
+    missing = []
+    for num in facility_nums:
+        if num in cached:
+            done(num, cached[num])
+        else:
+            missing.append(num)
+    if not missing:
+        return results
+
+    if not os.getenv("RAKUTEN_APP_ID") or not os.getenv("RAKUTEN_AFFILIATE_ID"):
+        for num in missing:
+            done(num, {"error": "APIキーが設定されていません (.env を確認してください)"})
+        return results
+
+    # 他のリクエストが同じ施設を問い合わせ中なら、その結果を待って使う
+    owned = {}
+    waiting = {}
+    for num in missing:
+        call, leader = hotel_lookups.acquire(num)
+        if leader:
+            owned[num] = call
+        else:
+            waiting[num] = call
 
-def make_row_list_from_dict(data_dict):
-    return [
-        data_dict.get("施設番号", ""),
-        data_dict.get("施設名", ""),
-        data_dict.get("都道府県コード", ""),
-        data_dict.get("市区町村コード", ""),
-        "",
-        data_dict.get("販売期間(from)", ""),
-        data_dict.get("販売期間(to)", ""),
-        data_dict.get("出発期間(from)", ""),
-        data_dict.get("出発期間(to)", ""),
-        data_dict.get("発空港", ""),
-        data_dict.get("参加人数オプション", ""),
-        data_dict.get("時間", ""),
-        data_dict.get("時間", ""),
-        data_dict.get("曜日", ""),
-        data_dict.get("粗利率1", ""),
-        data_dict.get("粗利率2", ""),
-        data_dict.get("粗利率3", ""),
-        "Ａ"
-    ]
+    try:
+        nums = list(owned)
+        batches = [nums[i:i + RAKUTEN_BATCH_SIZE] for i in range(0, len(nums), RAKUTEN_BATCH_SIZE)]
+        workers = max(1, min(RAKUTEN_MAX_WORKERS, len(batches)))
+        if batches:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for batch_results in executor.map(_fetch_batch, batches):
+                    for num, info in batch_results.items():
+                        hotel_lookups.resolve(num, owned.pop(num), info)
+                        done(num, info)
+    finally:
+        # 途中で例外になった場合も、待っている他のリクエストを止めないようにする
+        for num, call in owned.items():
+            hotel_lookups.resolve(num, call, {"error": "APIエラー: 問い合わせに失敗しました"})
+
+    # 自分の分を返し終えてから待つ（お互いに待ち合って止まることがないように）
+    for num, call in waiting.items():
+        done(num, call.wait())
+    return results
+
+def check_facility(facility_num, facility_name, info):
+    """ホテル情報と入力された施設名を照合し、CSV用の施設情報（またはエラー）を返す"""
+    if "error" in info:
+        return info
+
+    hotel_name = info["hotelName"]
+    if facility_name.strip() == hotel_name.strip():
+        return {
+            "施設番号": facility_num,
+            "施設名": hotel_name,
+            "都道府県コード": info["middleClassCode"],
+            "市区町村コード": info["smallClassCode"],
+        }
+    else:
+        return {"error": f"施設名が一致しません: {facility_num} ({facility_name} ≠ {hotel_name})"}
+
+def active_weekday_mask(periods):
+    """出発期間ごとに、出発可能な曜日（youbi_list の順）を表す真偽値の配列を返す
+
+    periods: [(出発期間from, 出発期間to), ...]（YYYY/MM/DD）
+    戻り値: shape (len(periods), 7) の bool 配列。日付が不正な期間はすべて False。
+    1日ずつ数えずに「開始曜日から何日分か」を剰余で一括計算する。
+    """
+    starts = []
+    lengths = []
+    for dep_from, dep_to in periods:
+        try:
+            start = datetime.strptime(dep_from, "%Y/%m/%d").toordinal()
+            end = datetime.strptime(dep_to, "%Y/%m/%d").toordinal()
+        except ValueError:
+            start, end = 0, -1
+        starts.append(start)
+        lengths.append(end - start + 1)
+
+    # toordinal() は 0001/01/01(月) が 1 なので、7 で割った余りが 日=0 … 土=6 になる
+    start_wd = np.array(starts, dtype=np.int64).reshape(-1, 1) % 7
+    length = np.array(lengths, dtype=np.int64).reshape(-1, 1)
+    offset = (np.arange(7, dtype=np.int64).reshape(1, -1) - start_wd) % 7
+    return offset < length
+
+def fetch_facilities(facilities, on_facility_done=None, known_hotels=None):
+    """[(施設番号, 施設名), ...] をまとめて問い合わせ、入力と同じ順で結果を返す
+
+    on_facility_done を渡すと、1施設の問い合わせが終わるたびに結果を渡して呼ぶ（進捗表示用）
+    known_hotels（{施設番号: ホテル情報（またはエラー）}、事前に取得済みのもの）に含まれる施設は
+    問い合わせずにその情報を使う。
+    """
+    if not facilities:
+        return []
+
+    # 同じ施設番号の行が複数あっても問い合わせは1回にする
+    names_by_num = {}
+    for num, name in facilities:
+        names_by_num.setdefault(str(num), []).append(name)
+
+    def hotel_done(num, info):
+        if on_facility_done is not None:
+            for name in names_by_num[num]:
+                on_facility_done(check_facility(num, name, info))
+
+    known_hotels = known_hotels or {}
+    infos = {}
+    for num in names_by_num:
+        known = known_hotels.get(num)
+        if known is not None:
+            infos[num] = known
+            hotel_done(num, known)
+    infos.update(fetch_hotel_infos([num for num in names_by_num if num not in infos], hotel_done))
+    return [check_facility(num, name, infos[str(num)]) for num, name in facilities]
+
+def warm_hotel_cache(facility_nums):
+    """施設番号の一覧をまとめて問い合わせてキャッシュに載せる。失敗分の [(番号, エラー)] を返す"""
+    infos = fetch_hotel_infos(facility_nums)
+    return [(num, info["error"]) for num, info in infos.items() if "error" in info]
 
-def get_active_days(start_date_str, end_date_str):
+# =========================
+# 入力の事前検証（楽天APIを呼ぶ前に、フォーム全体を1回で解釈・検証する）
+# =========================
+# 施設の入力行。error がある行は問い合わせない
+FacilityLine = namedtuple("FacilityLine", ["line_no", "line", "num", "name", "error"])
+# 出発期間1行分。youbi は出発可能な曜日（youbi_list の順）
+RatePeriod = namedtuple("RatePeriod", ["dep_from", "dep_to", "rates", "youbi"])
+# 変換に必要な入力をすべて解釈したもの。errors は施設行以外（フォーム全体）のエラー
+ConversionPlan = namedtuple("ConversionPlan", [
+    "facilities", "hotel_nums", "periods",
+    "hanbai_from", "hanbai_to", "hatsu_airport", "ninzu_list", "errors",
+])
+
+def _is_valid_date(slash_date):
+    # convert_date_to_slash_format は YYYY/MM/DD 形式をそのまま通すため、実在する日付か確認する
     try:
-        start_date = datetime.strptime(start_date_str, "%Y/%m/%d")
-        end_date = datetime.strptime(end_date_str, "%Y/%m/%d")
+        datetime.strptime(slash_date or "", "%Y/%m/%d")
+        return True
     except ValueError:
-        return set()
-
-    if (end_date - start_date).days >= 6:
-        return set(youbi_list)
+        return False
 
-    active_days = set()
-    current_date = start_date
-    weekday_map = {0: "MON", 1: "TUE", 2: "WED", 3: "THU", 4: "FRI", 5: "SAT", 6: "SUN"}
-
-    while current_date <= end_date:
-        wd = current_date.weekday()
-        active_days.add(weekday_map[wd])
-        current_date += timedelta(days=1)
-    
-    return active_days
-
-def transform_data_for_csv(data_dict):
+def compile_conversion(data_dict):
+    """入力フォームを ConversionPlan に変換する（通信は行わない）"""
     errors = []
-    facilities_raw = data_dict["施設番号"].strip().splitlines()
-    rate_lines_raw = data_dict["出発期間+粗利率"].strip().splitlines()
-    rate_lines = []
 
-    for line in rate_lines_raw:
+    raw_periods = []
+    for line in data_dict["出発期間+粗利率"].strip().splitlines():
         parts = line.split()
-        if len(parts) == 5:
-            rate_lines.append(parts)
-        else:
+        if len(parts) != 5:
             errors.append(f"出発期間+粗利率の形式が不正です: {line}")
+            continue
+
+        dep_from = convert_date_to_slash_format(parts[0])
+        dep_to = convert_date_to_slash_format(parts[1])
+        if not _is_valid_date(dep_from) or not _is_valid_date(dep_to):
+            errors.append(f"出発期間の日付形式が不正です: {' '.join(parts[:2])}")
+            continue
+        if dep_from > dep_to:
+            errors.append(f"出発期間の開始日が終了日より後です: {' '.join(parts[:2])}")
+            continue
+        raw_periods.append((dep_from, dep_to, tuple(parts[2:5])))
+
+    # 出発可能な曜日は全期間まとめて1回で計算する
+    mask = active_weekday_mask([(dep_from, dep_to) for dep_from, dep_to, _ in raw_periods])
+    periods = [
+        RatePeriod(dep_from, dep_to, rates, tuple(youbi_list[i] for i in np.flatnonzero(day_flags)))
+        for (dep_from, dep_to, rates), day_flags in zip(raw_periods, mask)
+    ]
 
-    hatsu_airport = data_dict["発空港"]
-    ninzu = data_dict["参加人数オプション"]
     hanbai_from = convert_date_to_slash_format(data_dict["販売期間(from)"])
     hanbai_to = convert_date_to_slash_format(data_dict["販売期間(to)"])
-
-    if not hanbai_from:
+    if not _is_valid_date(hanbai_from):
         errors.append("販売期間(from)の日付形式が不正です")
-    if not hanbai_to:
+    if not _is_valid_date(hanbai_to):
         errors.append("販売期間(to)の日付形式が不正です")
+    if _is_valid_date(hanbai_from) and _is_valid_date(hanbai_to) and hanbai_from > hanbai_to:
+        errors.append("販売期間の開始日が終了日より後です")
 
-    target_ninzu_list = []
+    ninzu = data_dict["参加人数オプション"]
     if ninzu == "全て":
-        target_ninzu_list = ["1", "2"]
+        ninzu_list = ["1", "2"]
     elif ninzu in ["1", "2"]:
-        target_ninzu_list = [ninzu]
+        ninzu_list = [ninzu]
     else:
+        ninzu_list = []
         errors.append("参加人数オプションが選択されていません")
 
+    facilities = []
+    for line_no, line in enumerate(data_dict["施設番号"].strip().splitlines(), start=1):
+        parts = line.strip().split(maxsplit=1)
+        num = parts[0] if parts else ""
+        name = parts[1] if len(parts) > 1 else ""
+        error = None
+        if len(parts) < 2:
+            error = f"施設番号と施設名の形式が不正です: {line}"
+        elif not num.isdigit():
+            error = f"施設番号が数字ではありません: {line}"
+        facilities.append(FacilityLine(line_no, line, num, name, error))
+
+    return ConversionPlan(
+        facilities=facilities,
+        hotel_nums=list(dict.fromkeys(f.num for f in facilities if f.error is None)),
+        periods=periods,
+        hanbai_from=hanbai_from,
+        hanbai_to=hanbai_to,
+        hatsu_airport=data_dict["発空港"],
+        ninzu_list=ninzu_list,
+        errors=errors,
+    )
+
+def validation_errors(plan, partial=False):
+    """問い合わせ前に確定するエラーの一覧（partial=True の場合、施設行のエラーは含めない）"""
+    errors = list(plan.errors)
+    if not partial:
+        errors.extend(f.error for f in plan.facilities if f.error is not None)
+    return errors
+
+def transform_data_for_csv(data_dict, progress=None, partial=False, known_hotels=None):
+    """入力フォームの内容を検証・変換する
+
+    入力の誤りはすべて楽天APIを呼ぶ前に検出して返す。
+    progress を渡すと、問い合わせる施設数を progress.start(件数) で、
+    1施設ごとの結果を progress.facility_done(結果) で通知する。
+    partial=True の場合は施設ごとのエラーで全体を止めず、成功した施設の行と
+    失敗した施設の一覧（"failed"）を返す。
+    known_hotels を渡すと、そこに含まれる施設は楽天APIに問い合わせない（fetch_facilities を参照）。
+    """
+    plan = compile_conversion(data_dict)
+    errors = validation_errors(plan, partial)
     if errors:
         return {"error": "\n".join(errors)}
 
-    row_list = []
-    for line in facilities_raw:
-        parts = line.strip().split(maxsplit=1) 
-        
-        if len(parts) < 2:
-            errors.append(f"施設番号と施設名の形式が不正です: {line}")
-            continue
+    # 正しい施設行だけまとめて問い合わせる
+    facilities = [(f.num, f.name) for f in plan.facilities if f.error is None]
+    if progress is not None:
+        progress.start(len(facilities))
+    api_results = iter(fetch_facilities(facilities, progress and progress.facility_done, known_hotels))
+
+    api_rows = []
+    failed = []
+    for facility in plan.facilities:
+        if facility.error is not None:
+            message = facility.error
+        else:
+            api_result = next(api_results)
+            if "error" not in api_result:
+                api_rows.append(api_result)
+                continue
+            message = api_result["error"]
 
-        facility_num, facility_name = parts[0], parts[1]
-        api_result = get_data_from_api(facility_num, facility_name)
+        errors.append(message)
+        failed.append({
+            "行番号": facility.line_no,
+            "施設番号": facility.num,
+            "施設名": facility.name,
+            "エラー": message,
+        })
 
-        if "error" in api_result:
-            errors.append(api_result["error"])
-            continue
+    if errors and not partial:
+        return {"error": "\n".join(errors)}
 
-        for rate in rate_lines:
-            dep_from = convert_date_to_slash_format(rate[0])
-            dep_to = convert_date_to_slash_format(rate[1])
-            if not dep_from or not dep_to:
-                errors.append(f"出発期間の日付形式が不正です: {' '.join(rate[:2])}")
-                continue
+    # 施設に依存しない列（販売期間〜末尾）を 出発期間 → 人数 → 曜日 の順にあらかじめ作っておく
+    # 作成日時は1回の変換で共通の値にする
+    now_str = datetime.now(JST).strftime("%Y/%m/%d %H:%M:%S")
+    row_suffixes = []
+    for period in plan.periods:
+        for current_ninzu in plan.ninzu_list:
+            for youbi in period.youbi:
+                row_suffixes.append([
+                    plan.hanbai_from, plan.hanbai_to, period.dep_from, period.dep_to, plan.hatsu_airport,
+                    current_ninzu, now_str, now_str, youbi,
+                    period.rates[0], period.rates[1], period.rates[2], "Ａ",
+                ])
+
+    def iter_rows():
+        # CSVの行を1行ずつ生成する（全行をメモリに溜めない）
+        for api_result in api_rows:
+            prefix = [
+                api_result["施設番号"],
+                api_result["施設名"],
+                api_result["都道府県コード"],
+                api_result["市区町村コード"],
+                "",
+            ]
+            for suffix in row_suffixes:
+                yield prefix + suffix
+
+    return {"rows": iter_rows(), "failed": failed}
+
+# 失敗した施設の一覧（エラーシート）の列
+ERROR_SHEET_COLUMNS = ["行番号", "施設番号", "施設名", "エラー"]
+
+def iter_error_sheet_bytes(failed):
+    """失敗した施設の一覧を errors.csv のバイト列で返す"""
+    return iter_error_csv_bytes(ERROR_SHEET_COLUMNS, ([item[col] for col in ERROR_SHEET_COLUMNS] for item in failed))
+
+def read_uploaded_csv(file_storage):
+    """アップロードされた Shift-JIS のCSV（以前の converted.csv など）を行のリストで返す"""
+    text = file_storage.read().decode("shift_jis", errors="replace")
+    return [row for row in csv.reader(io.StringIO(text)) if row]
+
+def merge_rows(previous_rows, new_rows, replaced_facilities):
+    """以前の出力に再実行分の行をマージする
+
+    replaced_facilities に含まれる施設番号の行は以前の出力から取り除き、
+    再実行で得た行を末尾に追加する。それ以外の行は以前の順序のまま残す。
+    """
+    for row in previous_rows:
+        if row[0] not in replaced_facilities:
+            yield row
+    yield from new_rows
 
-            active_days_in_period = get_active_days(dep_from, dep_to)
-
-            for current_ninzu in target_ninzu_list:
-                new_dict = api_result.copy()
-                new_dict["販売期間(from)"] = hanbai_from
-                new_dict["販売期間(to)"] = hanbai_to
-                new_dict["出発期間(from)"] = dep_from
-                new_dict["出発期間(to)"] = dep_to
-                new_dict["発空港"] = hatsu_airport
-                new_dict["参加人数オプション"] = current_ninzu 
-                new_dict["粗利率1"] = rate[2]
-                new_dict["粗利率2"] = rate[3]
-                new_dict["粗利率3"] = rate[4]
-                new_dict["時間"] = datetime.now(JST).strftime("%Y/%m/%d %H:%M:%S")
-
-                for youbi in youbi_list:
-                    if youbi in active_days_in_period:
-                        tmp = new_dict.copy()
-                        tmp["曜日"] = youbi
-                        row_list.append(make_row_list_from_dict(tmp))
+# =========================
+# 前回の出力との差分（増分変換）
+# =========================
+# converted.csv の列数と、行を識別する列（施設番号, 出発期間from, 出発期間to, 人数, 曜日）
+CONVERTED_COLUMN_COUNT = 18
+ROW_KEY_COLUMNS = (0, 7, 8, 10, 13)
+# 内容の比較から除く列（作成日時）
+ROW_TIMESTAMP_COLUMNS = (11, 12)
+
+def validate_previous_rows(previous_rows):
+    """前回の出力の形式を確認し、エラーメッセージのリストを返す"""
+    return [
+        f"前回の変換結果の {no} 行目の列数が不正です（{len(row)} 列）"
+        for no, row in enumerate(previous_rows, start=1)
+        if len(row) != CONVERTED_COLUMN_COUNT
+    ][:10]
+
+def hotels_from_rows(previous_rows):
+    """前回の出力から {施設番号: ホテル情報} を取り出す"""
+    hotels = {}
+    for row in previous_rows:
+        hotels.setdefault(row[0], {
+            "hotelName": row[1],
+            "middleClassCode": row[2],
+            "smallClassCode": row[3],
+        })
+    return hotels
+
+def reusable_hotels(previous_rows, data_dict):
+    """前回の出力のホテル情報のうち、今回の入力と施設名が一致する施設の分を返す
+
+    施設名が変わった施設は、ホテル側の名称変更の可能性があるため問い合わせ直す。
+    """
+    names_by_num = {}
+    for facility in compile_conversion(data_dict).facilities:
+        names_by_num.setdefault(facility.num, set()).add(facility.name.strip())
+    return {
+        num: info for num, info in hotels_from_rows(previous_rows).items()
+        if names_by_num.get(num) == {info["hotelName"].strip()}
+    }
 
-    if errors:
-        return {"error": "\n".join(errors)}
+def _row_key(row, seen):
+    # 同じキーの行が複数ある場合（出発期間の重複など）は出現順で区別する
+    key = tuple(row[i] for i in ROW_KEY_COLUMNS)
+    count = seen.get(key, 0)
+    seen[key] = count + 1
+    return key + (count,)
+
+def _row_content(row):
+    return tuple(v for i, v in enumerate(row) if i not in ROW_TIMESTAMP_COLUMNS)
+
+def reconcile_rows(previous_rows, new_rows, kept_facilities=(), diff_only=False, stats=None):
+    """今回の行を前回の出力と突き合わせる
+
+    diff_only=False: 今回の入力全体の行を返す。内容が変わっていない行は前回の行（作成日時も前回のまま）を使う。
+    diff_only=True:  先頭に「追加」「変更」「削除」の列を付けた、前回との差分の行だけを返す。
+    kept_facilities（今回失敗した施設）の前回の行は削除扱いにせず残す。
+    stats を渡すと、追加・変更・変更なし・削除の件数を書き込む。
+    """
+    if stats is None:
+        stats = {}
+    stats.update(added=0, changed=0, unchanged=0, removed=0)
+
+    previous = {}
+    seen = {}
+    for row in previous_rows:
+        previous[_row_key(row, seen)] = row
+
+    seen = {}
+    for row in new_rows:
+        old = previous.pop(_row_key(row, seen), None)
+        if old is None:
+            stats["added"] += 1
+            yield ["追加"] + row if diff_only else row
+        elif _row_content(old) != _row_content(row):
+            stats["changed"] += 1
+            yield ["変更"] + row if diff_only else row
+        else:
+            stats["unchanged"] += 1
+            if not diff_only:
+                yield old
+
+    # 今回の出力にない前回の行
+    for row in previous.values():
+        if row[0] in kept_facilities:
+            stats["unchanged"] += 1
+            if not diff_only:
+                yield row
+        else:
+            stats["removed"] += 1
+            if diff_only:
+                yield ["削除"] + row
 
-    return {"rows": row_list}
+def build_partial_zip(rows, failed, csv_name="converted.csv"):
+    """変換結果（converted.csv）とエラーシート（errors.csv）をまとめたzipを作る"""
+    return build_zip([(csv_name, iter_csv_bytes(rows)), ("errors.csv", iter_error_sheet_bytes(failed))])
 
 # =========================
 # ルート（Blueprint用）
@@ -212,33 +606,174 @@ def transform_data_for_csv(data_dict):
 def index():
     return render_template("work_optimize1.html")
 
+def form_to_data_dict(form):
+    return {
+        "出発期間+粗利率": form.get("departure_rate", ""),
+        "施設番号": form.get("facility", ""),
+        "販売期間(from)": form.get("sale_from", ""),
+        "販売期間(to)": form.get("sale_to", ""),
+        "発空港": form.get("airport", ""),
+        "参加人数オプション": form.get("participants", ""),
+    }
+
 @work_optimize1_bp.route("/convert", methods=["POST"])
 def convert():
-    data_dict = {
-        "出発期間+粗利率": request.form.get("departure_rate", ""),
-        "施設番号": request.form.get("facility", ""),
-        "販売期間(from)": request.form.get("sale_from", ""),
-        "販売期間(to)": request.form.get("sale_to", ""),
-        "発空港": request.form.get("airport", ""),
-        "参加人数オプション": request.form.get("participants", ""),
-    }
+    data_dict = form_to_data_dict(request.form)
+    previous_csv = request.files.get("previous_csv")
+    if previous_csv is not None and not previous_csv.filename:
+        previous_csv = None
+
+    # 部分出力モード: 成功した施設の行とエラーシートをzipで返す
+    # 以前の converted.csv を添付した場合は previous_mode によって
+    #   retry … 今回入力した施設の行だけを差し替える
+    #   full  … 今回の入力全体を出力する（前回と同じ施設は問い合わせず、変わっていない行は前回の行を使う）
+    #   diff  … full と同じ処理を行い、前回からの追加・変更・削除の行だけを出力する
+    if request.form.get("partial") == "1" or previous_csv is not None:
+        previous_rows = read_uploaded_csv(previous_csv) if previous_csv is not None else None
+        previous_mode = request.form.get("previous_mode", "retry")
+        incremental = previous_rows is not None and previous_mode in ("full", "diff")
+        known_hotels = None
+        if incremental:
+            previous_errors = validate_previous_rows(previous_rows)
+            if previous_errors:
+                return f"<h1>エラー:</h1><h2>{'<br>'.join(previous_errors)}</h2>", 400
+            known_hotels = reusable_hotels(previous_rows, data_dict)
+
+        result = transform_data_for_csv(data_dict, partial=True, known_hotels=known_hotels)
+        if "error" in result:
+            return f"<h1>エラー:</h1><h2>{result['error'].replace(chr(10), '<br>')}</h2>", 400
+
+        rows = result["rows"]
+        csv_name = "converted.csv"
+        stats = {}
+        failed_facilities = {item["施設番号"] for item in result["failed"]}
+        if incremental:
+            rows = reconcile_rows(previous_rows, rows, failed_facilities,
+                                  diff_only=previous_mode == "diff", stats=stats)
+            if previous_mode == "diff":
+                csv_name = "diff.csv"
+        elif previous_rows is not None:
+            # 今回も失敗した施設は前回の行を残す（reconcile_rows の kept_facilities と同じ扱い）
+            retried = {line.split()[0] for line in data_dict["施設番号"].splitlines() if line.strip()}
+            retried -= failed_facilities
+            rows = merge_rows(previous_rows, rows, retried)
+
+        response = send_file(
+            build_partial_zip(rows, result["failed"], csv_name),
+            mimetype="application/zip",
+            as_attachment=True,
+            download_name="converted.zip",
+        )
+        # 差分の件数（zip を作り終えた時点で確定している）
+        for key, value in stats.items():
+            response.headers[f"X-Rows-{key.capitalize()}"] = str(value)
+        return response
 
     result = transform_data_for_csv(data_dict)
 
     if "error" in result:
         return f"<h1>エラー:</h1><h2>{result['error'].replace(chr(10), '<br>')}</h2>", 400
 
-    csv_rows = result["rows"]
+    # 生成した行をその都度 Shift-JIS に変換して送る（出力サイズによらずメモリ使用量は一定）
+    return Response(
+        iter_csv_bytes(result["rows"]),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=converted.csv"},
+    )
+
+
+# =========================
+# 非同期ジョブ（大量の施設を変換する場合用）
+#   POST /opt1/jobs                 … ジョブを登録して job_id を返す
+#   GET  /opt1/jobs/<id>            … 進捗（処理済み施設数・エラー）
+#   GET  /opt1/jobs/<id>/download   … 完了したCSVのダウンロード
+# =========================
+
+class JobProgress:
+    """transform_data_for_csv の進捗をジョブの状態に書き込む"""
+
+    def __init__(self, job):
+        self.job = job
+        self.done = 0
+        self._lock = threading.Lock()
 
-    output = io.StringIO()
-    writer = csv.writer(output, quoting=csv.QUOTE_ALL)
-    for row in csv_rows:
-        writer.writerow(row)
-    output.seek(0)
+    def start(self, total):
+        self.job.set_progress(facilities_total=total, facilities_done=0)
 
+    def facility_done(self, result):
+        with self._lock:
+            self.done += 1
+            self.job.set_progress(facilities_done=self.done)
+        if "error" in result:
+            self.job.add_error(result["error"])
+
+def run_convert_job(data_dict, job):
+    result = transform_data_for_csv(data_dict, JobProgress(job))
+    if "error" in result:
+        return result
+    return iter_csv_bytes(result["rows"])
+
+convert_jobs = JobManager(
+    "opt1",
+    run_convert_job,
+    spool_dir=os.getenv("OPT1_JOB_DIR") or None,
+    max_workers=int(os.getenv("OPT1_JOB_WORKERS", "2")),
+)
+
+@work_optimize1_bp.route("/jobs", methods=["POST"])
+def submit_job():
+    data_dict = form_to_data_dict(request.form)
+    # 入力の誤りはジョブを登録する前に返す
+    errors = validation_errors(compile_conversion(data_dict))
+    if errors:
+        return jsonify({"errors": errors}), 400
+    job_id = convert_jobs.submit(data_dict)
+    return jsonify({
+        "job_id": job_id,
+        "status_url": url_for("work_optimize1.job_status", job_id=job_id),
+        "download_url": url_for("work_optimize1.job_download", job_id=job_id),
+    }), 202
+
+@work_optimize1_bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    status = convert_jobs.get(job_id)
+    if status is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(status)
+
+@work_optimize1_bp.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    status = convert_jobs.get(job_id)
+    if status is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    if status["state"] != "done":
+        return jsonify({"error": "ジョブはまだ完了していません", "state": status["state"]}), 409
     return send_file(
-        io.BytesIO(output.getvalue().encode("shift_jis", errors="replace")),
+        convert_jobs.result_path(job_id),
         mimetype="text/csv",
         as_attachment=True,
         download_name="converted.csv",
     )
+
+
+# =========================
+# 運用コマンド
+#   flask --app app work_optimize1 warm-hotel-cache 123456 234567
+#   flask --app app work_optimize1 warm-hotel-cache --file facilities.txt
+# =========================
+
+@work_optimize1_bp.cli.command("warm-hotel-cache")
+@click.argument("facility_nums", nargs=-1)
+@click.option("--file", "file_path", type=click.Path(exists=True, dir_okay=False),
+              help="施設番号の一覧ファイル（1行1施設、施設名付きの貼り付け形式も可）")
+def warm_hotel_cache_command(facility_nums, file_path):
+    """施設番号の一覧からホテル情報キャッシュを事前に作成する"""
+    nums = list(facility_nums)
+    if file_path:
+        with open(file_path, "r", encoding="utf-8") as f:
+            nums.extend(line.split()[0] for line in f if line.strip())
+
+    failed = warm_hotel_cache(nums)
+    click.echo(f"{len(set(nums)) - len(failed)} 件をキャッシュしました")
+    for num, error in failed:
+        click.echo(f"失敗: {num}: {error}", err=True)
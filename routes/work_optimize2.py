@@ -1,9 +1,14 @@
-from flask import Blueprint, request, send_file, render_template
+from flask import Blueprint, Response, request, render_template, send_file
 import io
 import csv
+import json
+import re
 import zoneinfo
 from datetime import datetime
 from dotenv import load_dotenv
+from markupsafe import escape
+from werkzeug.datastructures import MultiDict
+from routes.csv_export import iter_error_csv_bytes, build_zip
 
 # Blueprintの定義
 work_optimize2_bp = Blueprint('work_optimize2', __name__)
@@ -11,106 +16,268 @@ work_optimize2_bp = Blueprint('work_optimize2', __name__)
 # .env の読み込み
 load_dotenv()
 
+youbi_list = ["SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT"]
+participants_map = {"1": "1人", "2": "2人以上", "全て": "全て"}
+JST = zoneinfo.ZoneInfo("Asia/Tokyo")
+
+# ===== 利益率取得（name="profit_adult[]" でも "profit_adult" でも対応） =====
+def safe_getlist(form, base_name):
+    lst = form.getlist(base_name)
+    if not lst:
+        lst = form.getlist(base_name + "[]")
+    return [v if v is not None else "" for v in lst]
+
+def pad_to_7(lst):
+    out = list(lst[:7])
+    while len(out) < 7:
+        out.append("0")
+    return out
+
+def expand_allweek(raw_list, flag):
+    if flag:
+        sun_value = raw_list[0] if raw_list else "0"
+        return [sun_value] * 7
+    return raw_list
+
+def parse_spec(form):
+    """フォーム（.get / .getlist を持つもの）から1路線分の出力仕様を作る"""
+    # ===== 基本情報 =====
+    flight_number = form.get("flight_number", "").strip()
+    participants = form.get("participants", "")
+
+    # 便番号が複数行の場合にも対応
+    flight_numbers = [f.strip() for f in flight_number.splitlines() if f.strip()]
+    if not flight_numbers:
+        flight_numbers = [""]
+
+    profits = {}
+    for kind in ("adult", "child", "infant"):
+        raw = pad_to_7(safe_getlist(form, f"profit_{kind}"))
+        allweek = form.get(f"profit_{kind}_allweek") == "1"
+        profits[kind] = expand_allweek(raw, allweek)
+
+    return {
+        "flight_numbers": flight_numbers,
+        "route": form.get("routes", ""),
+        "sale_from": form.get("sale_from", "").strip(),
+        "sale_to": form.get("sale_to", "").strip(),
+        "flight_from": form.get("flight_from", "").strip(),
+        "flight_to": form.get("flight_to", "").strip(),
+        "day": form.get("day", "").strip(),
+        "airport": form.get("airport", "").strip(),
+        "participants": participants_map.get(participants, participants),
+        "adult_profits": profits["adult"],
+        "child_profits": profits["child"],
+        "infant_profits": profits["infant"],
+    }
+
+# ===== CSV生成 =====
+# 列: 便番号, 路線, 販売期間(From), 販売期間(To), 搭乗期間(From), 搭乗期間(To), 日数,
+#     発空港コード, 参加者, 作成日時, 曜日, 大人利益率, 子供利益率, 幼児利益率
+# 便番号以外の列は曜日ごとに決まるため、便番号の後ろに続く部分を曜日ごとに
+# 1回だけ Shift-JIS に変換しておき、便番号だけを変換して連結する。
+
+def encode_field(value):
+    """csv.writer(quoting=QUOTE_ALL) と同じ形式の1列分を Shift-JIS で返す"""
+    return ('"' + str(value).replace('"', '""') + '"').encode("shift_jis", errors="replace")
+
+def build_row_tails(spec, now_str):
+    """曜日ごとの「便番号より後ろ」の列（先頭のカンマと改行を含む）"""
+    prefix = b",".join(encode_field(v) for v in (
+        spec["route"],
+        spec["sale_from"],
+        spec["sale_to"],
+        spec["flight_from"],
+        spec["flight_to"],
+        spec["day"],
+        spec["airport"],
+        spec["participants"],
+        now_str,
+    ))
+    return [
+        b"," + prefix + b"," + b",".join(encode_field(v) for v in (
+            youbi,
+            spec["adult_profits"][idx],
+            spec["child_profits"][idx],
+            spec["infant_profits"][idx],
+        )) + b"\r\n"
+        for idx, youbi in enumerate(youbi_list)
+    ]
+
+def iter_spec_csv_bytes(spec, now_str, chunk_flights=500):
+    """1路線分のCSVを Shift-JIS のバイト列として少しずつ返す"""
+    tails = build_row_tails(spec, now_str)
+    chunk = []
+    for fn in spec["flight_numbers"]:
+        head = encode_field(fn)
+        for tail in tails:
+            chunk.append(head)
+            chunk.append(tail)
+        if len(chunk) >= chunk_flights * 14:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+# =========================
+# 一括変換（路線仕様ファイルのアップロード）
+# =========================
+# 仕様ファイルの列（JSONの場合はキー）は入力フォームの name と同じ。
+#   flight_number … 便番号（複数ある場合は改行・空白・| 区切り、JSONでは配列も可）
+#   profit_adult / profit_child / profit_infant … 日〜土の7つの利益率（空白・| 区切り、JSONでは配列も可）
+#   profit_*_allweek … "1" の場合は日曜の値を全曜日に使う
+SPEC_TEXT_FIELDS = ["routes", "sale_from", "sale_to", "flight_from", "flight_to", "day", "airport", "participants"]
+SPEC_LIST_FIELDS = ["profit_adult", "profit_child", "profit_infant"]
+SPEC_FLAG_FIELDS = ["profit_adult_allweek", "profit_child_allweek", "profit_infant_allweek"]
+SPEC_ERROR_COLUMNS = ["仕様番号", "便番号", "エラー"]
+
+def _split_values(value):
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v for v in re.split(r"[\s|]+", str(value or "")) if v]
+
+def spec_record_to_form(record):
+    """仕様ファイルの1件（dict）を parse_spec に渡せる形に変換する"""
+    form = MultiDict()
+    form["flight_number"] = "\n".join(_split_values(record.get("flight_number", "")))
+    for name in SPEC_TEXT_FIELDS:
+        form[name] = str(record.get(name, "") or "")
+    for name in SPEC_LIST_FIELDS:
+        form.setlist(name, _split_values(record.get(name, "")))
+    for name in SPEC_FLAG_FIELDS:
+        value = record.get(name, "")
+        form[name] = "1" if value is True or str(value).strip() in ("1", "true", "TRUE") else ""
+    return form
+
+def read_spec_records(file_storage):
+    """アップロードされた仕様ファイル（CSV または JSON）を dict のリストにする"""
+    return parse_spec_records(file_storage.read(), file_storage.filename)
+
+def parse_spec_records(raw, filename):
+    """仕様ファイルの内容（バイト列）を dict のリストにする"""
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Excel で保存したCSVは Shift-JIS のことが多い
+        text = raw.decode("shift_jis", errors="replace")
+
+    if (filename or "").lower().endswith(".json") or text.lstrip().startswith(("[", "{")):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("specs", [data])
+        if not isinstance(data, list):
+            raise ValueError("仕様の配列（[...]）で指定してください")
+        return [r if isinstance(r, dict) else {} for r in data]
+    return list(csv.DictReader(io.StringIO(text)))
+
+def _is_date(value):
+    for fmt in ("%Y%m%d", "%Y/%m/%d"):
+        try:
+            datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+def validate_spec(form):
+    """1件分の仕様を検証し、エラーメッセージのリストを返す"""
+    errors = []
+    if not form.get("flight_number", "").strip():
+        errors.append("便番号がありません")
+    if form.get("routes", "") not in ("往路", "復路"):
+        errors.append(f"路線が不正です: {form.get('routes', '')}")
+    for name, label in (("sale_from", "販売期間(From)"), ("sale_to", "販売期間(To)"),
+                        ("flight_from", "搭乗期間(From)"), ("flight_to", "搭乗期間(To)")):
+        if not _is_date(form.get(name, "").strip()):
+            errors.append(f"{label}の日付形式が不正です: {form.get(name, '')}")
+    if not form.get("day", "").strip().isdigit() or int(form.get("day").strip()) < 1:
+        errors.append(f"日数が不正です: {form.get('day', '')}")
+    if not form.get("airport", "").strip():
+        errors.append("発空港がありません")
+    if form.get("participants", "") not in participants_map:
+        errors.append(f"参加者が不正です: {form.get('participants', '')}")
+    for name in SPEC_LIST_FIELDS:
+        values = form.getlist(name)
+        if len(values) > 7:
+            errors.append(f"{name} は7つまでです")
+        for v in values:
+            try:
+                float(v)
+            except ValueError:
+                errors.append(f"{name} に数値以外が含まれています: {v}")
+                break
+    return errors
+
+def compile_bulk_specs(records):
+    """全件を1回で検証・変換し、(有効な仕様のリスト, エラーのリスト) を返す"""
+    specs = []
+    errors = []
+    for no, record in enumerate(records, start=1):
+        form = spec_record_to_form(record)
+        spec_errors = validate_spec(form)
+        if spec_errors:
+            for message in spec_errors:
+                errors.append([str(no), form.get("flight_number", "").replace("\n", " "), message])
+            continue
+        specs.append(parse_spec(form))
+    return specs, errors
+
+def iter_bulk_csv_bytes(specs, now_str):
+    for spec in specs:
+        yield from iter_spec_csv_bytes(spec, now_str)
+
+def iter_spec_error_bytes(errors):
+    """仕様ごとのエラー一覧を errors.csv のバイト列で返す"""
+    return iter_error_csv_bytes(SPEC_ERROR_COLUMNS, errors)
+
 @work_optimize2_bp.route("/work_optimize2")
 def index():
     return render_template("work_optimize2.html")
 
 @work_optimize2_bp.route("/convert", methods=["POST"])
 def convert():
+    spec = parse_spec(request.form)
+    now_str = datetime.now(JST).strftime("%Y/%m/%d %H:%M:%S")
 
-    # ===== 基本情報 =====
-    flight_number = request.form.get("flight_number", "").strip()
-    route = request.form.get("routes", "")
-    sale_from = request.form.get("sale_from", "").strip()
-    sale_to = request.form.get("sale_to", "").strip()
-    flight_from = request.form.get("flight_from", "").strip()
-    flight_to = request.form.get("flight_to", "").strip()
-    day = request.form.get("day", "").strip()
-    airport = request.form.get("airport", "").strip()
-    participants = request.form.get("participants", "")
-
-    # ===== 利益率取得（name="profit_adult[]" でも "profit_adult" でも対応） =====
-    def safe_getlist(base_name):
-        lst = request.form.getlist(base_name)
-        if not lst:
-            lst = request.form.getlist(base_name + "[]")
-        return [v if v is not None else "" for v in lst]
-
-    adult_raw = safe_getlist("profit_adult")
-    child_raw = safe_getlist("profit_child")
-    infant_raw = safe_getlist("profit_infant")
-
-    def pad_to_7(lst):
-        out = list(lst[:7])
-        while len(out) < 7:
-            out.append("0")
-        return out
-
-    adult_raw = pad_to_7(adult_raw)
-    child_raw = pad_to_7(child_raw)
-    infant_raw = pad_to_7(infant_raw)
-
-    adult_allweek = request.form.get("profit_adult_allweek") == "1"
-    child_allweek = request.form.get("profit_child_allweek") == "1"
-    infant_allweek = request.form.get("profit_infant_allweek") == "1"
-
-    def expand_allweek(raw_list, flag):
-        if flag:
-            sun_value = raw_list[0] if raw_list else "0"
-            return [sun_value] * 7
-        return raw_list
-
-    adult_profits = expand_allweek(adult_raw, adult_allweek)
-    child_profits = expand_allweek(child_raw, child_allweek)
-    infant_profits = expand_allweek(infant_raw, infant_allweek)
-
-    youbi_list = ["SUN", "MON", "TUE", "WED", "THU", "FRI", "SAT"]
-
-    participants_map = {"1": "1人", "2": "2人以上", "全て": "全て"}
-    participants_disp = participants_map.get(participants, participants)
-
-    JST = zoneinfo.ZoneInfo("Asia/Tokyo")
+    return Response(
+        iter_spec_csv_bytes(spec, now_str),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=converted.csv"},
+    )
+
+@work_optimize2_bp.route("/bulk_convert", methods=["POST"])
+def bulk_convert():
+    spec_file = request.files.get("spec_file")
+    if spec_file is None or not spec_file.filename:
+        return "<h1>エラー:</h1><h2>仕様ファイルを選択してください</h2>", 400
+    try:
+        records = read_spec_records(spec_file)
+    except (ValueError, csv.Error) as e:
+        return f"<h1>エラー:</h1><h2>仕様ファイルを読み込めません: {escape(str(e))}</h2>", 400
+
+    specs, errors = compile_bulk_specs(records)
     now_str = datetime.now(JST).strftime("%Y/%m/%d %H:%M:%S")
 
-    # ===== CSV生成 =====
-    output = io.StringIO()
-    writer = csv.writer(output, quoting=csv.QUOTE_ALL)
-    """
-    writer.writerow([
-        "便番号","路線","販売期間(From)","販売期間(To)",
-        "搭乗期間(From)","搭乗期間(To)","日数","発空港コード",
-        "参加者","作成日時","曜日","大人利益率","子供利益率","幼児利益率"
-    ])
-    """
-    # 便番号が複数行の場合にも対応
-    flight_numbers = [f.strip() for f in flight_number.splitlines() if f.strip()]
-    if not flight_numbers:
-        flight_numbers = [""]
+    # zip の場合は変換結果とエラー一覧（errors.csv）をまとめて返す
+    if request.form.get("format") == "zip":
+        spool = build_zip([
+            ("converted.csv", iter_bulk_csv_bytes(specs, now_str)),
+            ("errors.csv", iter_spec_error_bytes(errors)),
+        ])
+        return send_file(spool, mimetype="application/zip", as_attachment=True, download_name="converted.zip")
+
+    if not specs:
+        messages = "<br>".join(escape(f"{no}: {fn} {message}") for no, fn, message in errors)
+        return f"<h1>エラー:</h1><h2>{messages or '仕様がありません'}</h2>", 400
 
-    for fn in flight_numbers:
-        for idx, youbi in enumerate(youbi_list):
-            writer.writerow([
-                fn,
-                route,
-                sale_from,
-                sale_to,
-                flight_from,
-                flight_to,
-                day,
-                airport,
-                participants_disp,
-                now_str,
-                youbi,
-                adult_profits[idx],
-                child_profits[idx],
-                infant_profits[idx],
-            ])
-
-    output.seek(0)
-
-    return send_file(
-        io.BytesIO(output.getvalue().encode("shift_jis", errors="replace")),
+    # CSV の場合、エラーになった仕様は出力から除き、件数をヘッダーで知らせる
+    return Response(
+        iter_bulk_csv_bytes(specs, now_str),
         mimetype="text/csv",
-        as_attachment=True,
-        download_name="converted.csv",
+        headers={
+            "Content-Disposition": "attachment; filename=converted.csv",
+            "X-Spec-Count": str(len(specs)),
+            # 1つの仕様で複数のエラーが出ることがあるため、仕様番号の数を数える
+            "X-Spec-Error-Count": str(len({error[0] for error in errors})),
+        },
     )
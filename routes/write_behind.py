@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import random
+import threading
+import traceback
+import requests
+from routes.local_db import ThreadLocalSqlite
+
+# =========================
+# 外部サービスへの書き込みを後回しにするための送信待ちキュー
+#
+# put() はローカルのSQLiteファイルに書き込んだ時点で戻る（ここで永続化される）。
+# バックグラウンドのスレッドが溜まった分をまとめて send_batch に渡し、
+# 失敗した場合は待ち時間を伸ばしながら（ジッター付き）再送する。
+# 同じファイルを複数のワーカーが使っても、送信はリース付きで1つのワーカーだけが行う
+# （他のワーカーが送信中の間は新しい行を確保しないので、古い順に届く）。
+# =========================
+
+
+def post_each(payloads, post_one):
+    """payloads を古い順に post_one(payload) で1件ずつ送り、送信できた件数を返す（send_batch 用）
+
+    1件も送れないうちに失敗した場合は例外をそのまま投げる。途中まで送れた場合はその件数を返し、
+    残りは後で再送される。
+    """
+    sent = 0
+    for payload in payloads:
+        try:
+            post_one(payload)
+        except requests.RequestException:
+            if sent == 0:
+                raise
+            return sent
+        sent += 1
+    return sent
+
+
+class WriteBehindQueue:
+    def __init__(self, name, path, send_batch, batch_size=20, interval=2.0,
+                 max_backoff=300.0, lease=120.0):
+        """send_batch(payloads) は送信に成功した件数（先頭からの件数）を返すか、例外を投げる関数"""
+        self.name = name
+        self.path = path
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self._db = ThreadLocalSqlite(path, timeout=10, synchronous="FULL")
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+
+        # 状態（ステータス表示用、プロセス内）
+        self.sent_total = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_flush_at = None
+        self.retry_at = None
+
+        with self._db.connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.name}_outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " claimed_by TEXT,"
+                " claimed_until REAL)"
+            )
+
+    # ---------- 書き込み ----------
+
+    def put(self, payload):
+        """送信内容をローカルに保存する（戻った時点で消えない状態になっている）"""
+        with self._db.connect() as conn:
+            conn.execute(
+                f"INSERT INTO {self.name}_outbox (payload, created_at) VALUES (?, ?)",
+                (json.dumps(payload, ensure_ascii=False), time.time())
+            )
+        self.ensure_started()
+        self._wakeup.set()
+
+    # ---------- 状態 ----------
+
+    def status(self):
+        """送信待ちの件数や直近の送信状況を返す"""
+        self.ensure_started()
+        row = self._db.connect().execute(
+            f"SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM {self.name}_outbox"
+        ).fetchone()
+        pending, oldest, max_attempts = row
+        return {
+            "pending": pending,
+            "oldest_age_sec": round(time.time() - oldest, 1) if oldest else None,
+            "max_attempts": max_attempts or 0,
+            "sent_total": self.sent_total,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_flush_at": self.last_flush_at,
+            "retry_at": self.retry_at,
+        }
+
+    # ---------- 送信スレッド ----------
+
+    def ensure_started(self):
+        # gunicorn の fork 後は親のスレッドが存在しないため、プロセスごとに起動する
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-flusher", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _claim_batch(self):
+        """未送信の行を先頭から batch_size 件まで確保する
+
+        他のワーカーが期限内のリースを持っている間は何も確保しない（送信順が入れ替わらないように）。
+        """
+        owner = f"{os.getpid()}"
+        now = time.time()
+        conn = self._db.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            busy = conn.execute(
+                f"SELECT 1 FROM {self.name}_outbox"
+                " WHERE claimed_by IS NOT NULL AND claimed_by != ? AND claimed_until >= ? LIMIT 1",
+                (owner, now)
+            ).fetchone()
+            if busy:
+                return []
+            rows = conn.execute(
+                f"SELECT id, payload FROM {self.name}_outbox"
+                " WHERE claimed_by IS NULL OR claimed_until < ? OR claimed_by = ?"
+                " ORDER BY id LIMIT ?",
+                (now, owner, self.batch_size)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    f"UPDATE {self.name}_outbox SET claimed_by = ?, claimed_until = ?,"
+                    " attempts = attempts + 1 WHERE id = ?",
+                    [(owner, now + self.lease, row[0]) for row in rows]
+                )
+        return rows
+
+    def _release(self, ids):
+        with self._db.connect() as conn:
+            conn.executemany(
+                f"UPDATE {self.name}_outbox SET claimed_by = NULL, claimed_until = NULL WHERE id = ?",
+                [(i,) for i in ids]
+            )
+
+    def _delete(self, ids):
+        with self._db.connect() as conn:
+            conn.executemany(f"DELETE FROM {self.name}_outbox WHERE id = ?", [(i,) for i in ids])
+
+    def flush_once(self):
+        """1バッチ分を送信する。送信できるものがなければ False を返す"""
+        rows = self._claim_batch()
+        if not rows:
+            return False
+
+        ids = [row[0] for row in rows]
+        try:
+            sent = self.send_batch([json.loads(row[1]) for row in rows])
+        except Exception as e:
+            self._release(ids)
+            raise e
+
+        sent = max(0, min(sent, len(ids)))
+        self._delete(ids[:sent])
+        self._release(ids[sent:])
+        self.sent_total += sent
+        self.last_flush_at = time.time()
+        if sent < len(ids):
+            raise RuntimeError(f"{len(ids) - sent} 件の送信に失敗しました")
+        return True
+
+    def _run(self):
+        backoff = 0.0
+        consecutive_failures = 0
+        while True:
+            self._wakeup.wait(timeout=backoff or self.interval)
+            self._wakeup.clear()
+            if backoff:
+                # 失敗後は待ち時間が過ぎるまで再送しない（新しい書き込みがあっても待つ）
+                remaining = self.retry_at - time.time() if self.retry_at else 0
+                if remaining > 0:
+                    time.sleep(remaining)
+            try:
+                while self.flush_once():
+                    pass
+                backoff = 0.0
+                consecutive_failures = 0
+                self.retry_at = None
+            except Exception as e:
+                traceback.print_exc()
+                self.failures += 1
+                consecutive_failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                # 指数的に待ち時間を伸ばし、複数ワーカーが同時に再送しないよう揺らぎを加える
+                backoff = min(self.max_backoff, 2.0 ** consecutive_failures)
+                backoff = backoff * random.uniform(0.5, 1.0)
+                self.retry_at = time.time() + backoff